@@ -1,9 +1,11 @@
+from django.db import transaction
 from django.db.models import Count
 from django.contrib import admin, messages
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 
+from .bulk import bulk_update_products
 from .models import *
 
 
@@ -60,9 +62,12 @@ class ProductImageInline(admin.TabularInline):
     min_num = 1
     max_num = 10
 
+    # the small WebP variant once the worker has made it, the original until then
     def thumbnail(self, instance):
         if instance.image.name != '':
-            return format_html(f"<img src={instance.image.url} class='thumbnail'>")
+            name = instance.variants.get('thumbnail', {}).get('webp')
+            url = instance.image.storage.url(name) if name else instance.image.url
+            return format_html("<img src='{}' class='thumbnail'>", url)
 
 
 @admin.register(Product)
@@ -87,6 +92,22 @@ class ProductAdmin(admin.ModelAdmin):
     list_select_related = ['category']
     list_filter = ['category', 'last_updated', InventoryListFilter]
 
+    # list_editable saves are collected and written by the same bulk path as the API
+    def changelist_view(self, request, extra_context=None):
+        request.product_changes = []
+        with transaction.atomic():
+            response = super().changelist_view(request, extra_context)
+            if request.product_changes:
+                bulk_update_products(request.product_changes)
+        return response
+
+    def save_model(self, request, obj, form, change):
+        changes = getattr(request, 'product_changes', None)
+        if changes is None or not change:
+            return super().save_model(request, obj, form, change)
+        changes.append({'id': obj.id, **{name: form.cleaned_data[name]
+                                         for name in self.list_editable}})
+
     @admin.action(description='Clear Inventory')
     def clear_inventory(self, request, queryset):
         updated_products = queryset.update(inventory=0)
@@ -126,9 +147,6 @@ class CategoryAdmin(admin.ModelAdmin):
             str(category.id)
         return format_html('<a href={}>{}</a>', url, category.product_count)
 
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(product_count=Count('products'))
-
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -0,0 +1,259 @@
+import csv
+import io
+import json
+import os
+from decimal import Decimal
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from .models import RATING_STARS, Category, Product, rating_histogram_field
+from .search import reindex_products
+
+IMPORT_FORMATS = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+}
+IMPORT_FIELDS = ['title', 'slug', 'unit_price', 'description', 'inventory']
+BULK_UPDATE_FIELDS = ['unit_price', 'inventory']
+
+
+def get_import_format(filename, file_format=None):
+    file_format = file_format or IMPORT_FORMATS.get(
+        os.path.splitext(filename or '')[1].lower())
+    if file_format not in IMPORT_FORMATS.values():
+        raise ValidationError(
+            f'Unsupported import format, use one of: {", ".join(sorted(set(IMPORT_FORMATS.values())))}.')
+    return file_format
+
+
+def read_rows(stream, file_format):
+    """
+    Yields (line number, row) pairs from a binary CSV or JSON lines stream one
+    line at a time. Rows that cannot be parsed are yielded as a ValidationError.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            # numbers as Decimal: a float 19.99 would not pass DecimalField.clean()
+            row = json.loads(line, parse_float=Decimal)
+        except ValueError as error:
+            yield number, ValidationError(f'Invalid JSON: {error}')
+            continue
+        if not isinstance(row, dict):
+            row = ValidationError('Each line must be a JSON object.')
+        yield number, row
+
+
+class ProductImporter:
+    """
+    Upserts products (matched on slug) from parsed rows in bulk_create /
+    bulk_update batches. Rows are validated against the Product field rules and
+    categories are resolved by title with one query per batch. Only the current
+    batch and the first max_errors errors are ever held in memory.
+    """
+    batch_size = 1000
+    max_errors = 100
+
+    def __init__(self, batch_size=None, create_categories=False, progress=None):
+        self.batch_size = batch_size or self.batch_size
+        self.create_categories = create_categories
+        self.progress = progress
+        self.result = {'rows': 0, 'created': 0,
+                       'updated': 0, 'failed': 0, 'errors': []}
+
+    def run(self, rows):
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                return self.result
+            self.import_batch(batch)
+            if self.progress is not None:
+                self.progress(self.result)
+
+    def add_error(self, line, error):
+        self.result['failed'] += 1
+        if len(self.result['errors']) < self.max_errors:
+            messages = error.message_dict if hasattr(
+                error, 'error_dict') else error.messages
+            self.result['errors'].append({'line': line, 'errors': messages})
+
+    def clean_row(self, row):
+        values, errors = {}, {}
+        for name in IMPORT_FIELDS:
+            try:
+                values[name] = Product._meta.get_field(
+                    name).clean(row.get(name), None)
+            except ValidationError as error:
+                errors[name] = error.messages
+        category = (row.get('category') or '').strip()
+        if not category:
+            errors['category'] = ['This field cannot be blank.']
+        if errors:
+            raise ValidationError(errors)
+        return values, category
+
+    def get_categories(self, titles):
+        categories = {}
+        for category_id, title in Category.objects.filter(
+                title__in=titles).order_by('-id').values_list('id', 'title'):
+            categories[title] = category_id
+        missing = titles - categories.keys()
+        if missing and self.create_categories:
+            Category.objects.bulk_create(
+                [Category(title=title) for title in missing])
+            return self.get_categories(titles)
+        return categories
+
+    def import_batch(self, batch):
+        self.result['rows'] += len(batch)
+        cleaned = {}
+        for line, row in batch:
+            if isinstance(row, ValidationError):
+                self.add_error(line, row)
+                continue
+            try:
+                values, category = self.clean_row(row)
+            except ValidationError as error:
+                self.add_error(line, error)
+                continue
+            # a slug repeated within the batch keeps its last row
+            cleaned[values['slug']] = (line, values, category)
+
+        categories = self.get_categories(
+            {category for (line, values, category) in cleaned.values()})
+        existing = dict(Product.objects.filter(slug__in=cleaned).order_by(
+            '-id').values_list('slug', 'id'))
+
+        now = timezone.now()
+        to_create, to_update = [], []
+        for slug, (line, values, category) in cleaned.items():
+            if category not in categories:
+                self.add_error(line, ValidationError(
+                    {'category': [f'Unknown category "{category}".']}))
+                continue
+            product = Product(
+                category_id=categories[category], last_updated=now, **values)
+            if slug in existing:
+                product.pk = existing[slug]
+                to_update.append(product)
+            else:
+                to_create.append(product)
+
+        with transaction.atomic():
+            Product.objects.bulk_create(to_create)
+            Product.objects.bulk_update(
+                to_update, IMPORT_FIELDS + ['category', 'last_updated'])
+            reindex_products(Product.objects.filter(
+                slug__in=[product.slug for product in to_create + to_update]))
+        self.result['created'] += len(to_create)
+        self.result['updated'] += len(to_update)
+
+
+def bulk_update_products(changes, batch_size=1000):
+    """
+    Applies validated {'id', 'unit_price', 'inventory'} changes (either value
+    may be missing) with one locking SELECT and one UPDATE ... CASE per batch,
+    all in one transaction. Rows whose values are already current are not
+    written. Returns a result dict per change, in order.
+    """
+    results = []
+    now = timezone.now()
+    with transaction.atomic():
+        for start in range(0, len(changes), batch_size):
+            batch = changes[start:start + batch_size]
+            products = Product.objects.select_for_update().only(
+                'id', *BULK_UPDATE_FIELDS).in_bulk([change['id'] for change in batch])
+            changed = {}
+            for change in batch:
+                product = products.get(change['id'])
+                if product is None:
+                    results.append({'id': change['id'], 'status': 'not_found'})
+                    continue
+                updates = {name: change[name] for name in BULK_UPDATE_FIELDS
+                           if name in change and change[name] != getattr(product, name)}
+                if not updates:
+                    results.append({'id': product.id, 'status': 'unchanged'})
+                    continue
+                for name, value in updates.items():
+                    setattr(product, name, value)
+                product.last_updated = now
+                changed[product.id] = product
+                results.append({'id': product.id, 'status': 'updated'})
+            Product.objects.bulk_update(
+                changed.values(), BULK_UPDATE_FIELDS + ['last_updated'])
+    return results
+
+
+class SerializerRows:
+    """Exports through a regular serializer, for the models without a RowSerializer."""
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+
+    def serialize(self, instances):
+        return self.serializer_class(instances, many=True).data
+
+
+def iter_chunks(queryset, chunk_size):
+    """
+    Evaluates queryset with a server-side cursor, chunk_size rows at a time
+    (prefetch_related lookups are run per chunk).
+    """
+    rows = queryset.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def export_ndjson(row_serializer, queryset, chunk_size):
+    # one line per item, rendered exactly like the API renders it
+    renderer = JSONRenderer()
+    for chunk in iter_chunks(queryset, chunk_size):
+        yield b''.join(renderer.render(item) + b'\n'
+                       for item in row_serializer.serialize(chunk))
+
+
+def csv_columns(name):
+    # the histogram is flattened into one column per star, as on the product table
+    if name == 'rating_histogram':
+        return [rating_histogram_field(star) for star in RATING_STARS]
+    return [name]
+
+
+def csv_cells(name, value):
+    if name == 'rating_histogram':
+        return [value[str(star)] for star in RATING_STARS]
+    if name == 'images':
+        # images become a space separated list of their urls
+        return [' '.join(image['image'] or '' for image in value)]
+    return [value]
+
+
+def export_csv(row_serializer, queryset, chunk_size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(column for name, write in row_serializer.plan for column in csv_columns(name))
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for chunk in iter_chunks(queryset, chunk_size):
+        for item in row_serializer.serialize(chunk):
+            writer.writerow(cell for name, value in item.items() for cell in csv_cells(name, value))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
@@ -0,0 +1,147 @@
+import time
+from contextlib import contextmanager
+from hashlib import md5
+from urllib.parse import urlencode
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+CATALOG_VERSION_KEY = 'store:catalog:version'
+PROMOTION_VERSION_KEY = 'store:promotions:version'
+
+
+def get_version(key):
+    version = cache.get(key)
+    if version is None:
+        # seed from the clock so a lost counter can never come back to an old version
+        version = int(time.time() * 1000)
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def _incr_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        get_version(key)
+
+
+def bump_version(key):
+    """
+    Invalidates everything cached under the version stored at key. The version
+    is bumped right away and again on commit, so a reader racing the
+    transaction cannot cache the old rows under the new version.
+    """
+    _incr_version(key)
+    transaction.on_commit(lambda: _incr_version(key))
+
+
+def get_catalog_version():
+    return get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    # invalidates every cached catalog response
+    bump_version(CATALOG_VERSION_KEY)
+
+
+def get_promotion_version():
+    return get_version(PROMOTION_VERSION_KEY)
+
+
+def bump_promotion_version():
+    # invalidates the discounts cached in every process (see pricing.py)
+    bump_version(PROMOTION_VERSION_KEY)
+
+
+def top_reviews_cache_key(product_id):
+    return f'store:reviews:top:{product_id}'
+
+
+def invalidate_top_reviews(product_id):
+    # dropped now and on commit, for the same race as bump_catalog_version()
+    key = top_reviews_cache_key(product_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+class CacheLockTimeout(Exception):
+    pass
+
+
+@contextmanager
+def cache_lock(key, timeout=10, wait=5, backend=cache):
+    """
+    Mutual exclusion across processes through cache.add(). The lock expires
+    after timeout seconds in case its holder dies; waiting for it longer
+    than wait seconds raises CacheLockTimeout.
+    """
+    lock_key = f'{key}:lock'
+    token = uuid4().hex
+    deadline = time.monotonic() + wait
+    while not backend.add(lock_key, token, timeout):
+        if time.monotonic() >= deadline:
+            raise CacheLockTimeout(key)
+        time.sleep(0.01)
+    try:
+        yield
+    finally:
+        # never release a lock that expired and was taken by someone else
+        if backend.get(lock_key) == token:
+            backend.delete(lock_key)
+
+
+def normalize_query_params(query_params, names):
+    return urlencode(sorted(
+        (name, value)
+        for name in names
+        for value in query_params.getlist(name)
+        if value != ''
+    ))
+
+
+def catalog_cache_key(*parts):
+    digest = md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'store:catalog:{get_catalog_version()}:{digest}'
+
+
+class CatalogCacheMixin:
+    """
+    Serves list and retrieve responses from the default cache. Keys are built
+    from the query parameters in cache_query_params (anything else, like cache
+    busters, is ignored) and the catalog version, so entries go stale exactly
+    when bump_catalog_version() runs.
+    """
+    cache_query_params = []
+
+    def get_cache_key(self, request):
+        return catalog_cache_key(
+            self.basename,
+            self.action,
+            # pagination links are absolute, so the host is part of the payload
+            request.get_host(),
+            self.kwargs.get(self.lookup_url_kwarg or self.lookup_field, ''),
+            normalize_query_params(
+                request.query_params, self.cache_query_params)
+        )
+
+    def get_cached_response(self, view_method, request, *args, **kwargs):
+        key = self.get_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = view_method(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, settings.CATALOG_CACHE_TIMEOUT)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
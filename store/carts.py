@@ -0,0 +1,374 @@
+from contextlib import nullcontext
+from decimal import Decimal
+from uuid import UUID, uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Prefetch, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .caching import cache_lock
+from .models import Cart, CartItem, Product
+from .pricing import PRICE_FIELD, discounted_price_expression, line_total, pricing
+
+
+def get_cart_store():
+    """Returns an instance of the backend named by settings.CART_STORE."""
+    return import_string(settings.CART_STORE)()
+
+
+def parse_cart_id(cart_id):
+    try:
+        return UUID(str(cart_id))
+    except ValueError:
+        return None
+
+
+def merge_lines(lines):
+    # {product_id: total quantity} in first seen order, a product can only be upserted once
+    quantities = {}
+    for product_id, quantity in lines:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+class CartStore:
+    """
+    Where anonymous carts live until checkout. Carts are returned as Cart
+    instances with their lines in ``cart.items``: CartItem instances whose
+    ``product`` is loaded. Both are priced by store.pricing (items carry the
+    discounted ``unit_price`` and ``total_price``, carts ``total_price``).
+    Unknown carts and items are returned as None.
+    """
+
+    def create(self):
+        raise NotImplementedError
+
+    def get(self, cart_id):
+        raise NotImplementedError
+
+    def delete(self, cart_id):
+        """Returns whether the cart existed."""
+        raise NotImplementedError
+
+    def claim(self, cart_id):
+        """
+        Takes the cart out of the store for checkout, inside the checkout
+        transaction: returns its lines, or None when the cart does not exist
+        (anymore), so only one of concurrent checkouts gets them.
+        """
+        raise NotImplementedError
+
+    def release(self, cart_id):
+        """Puts back a claimed cart after its checkout failed."""
+
+    def exists(self, cart_id):
+        return self.get_lines(cart_id) is not None
+
+    def get_lines(self, cart_id):
+        """Returns [(product_id, quantity)] of the cart, or None if it does not exist."""
+        raise NotImplementedError
+
+    def get_item(self, cart_id, item_id):
+        raise NotImplementedError
+
+    def add_item(self, cart_id, product_id, quantity):
+        """
+        Adds quantity to the cart's line of product_id, creating it if needed.
+        Returns the item, or None if the product does not exist.
+        """
+        items = self.add_items(cart_id, [(product_id, quantity)])
+        return items[0] if items else None
+
+    def add_items(self, cart_id, lines):
+        """
+        add_item() for many (product_id, quantity) lines, all or nothing. Returns
+        the changed items (without product) in line order, or None when the cart
+        or any of the products does not exist.
+        """
+        raise NotImplementedError
+
+    def update_item(self, cart_id, item_id, quantity):
+        raise NotImplementedError
+
+    def remove_item(self, cart_id, item_id):
+        """Returns whether the item existed."""
+        raise NotImplementedError
+
+
+class DatabaseCartStore(CartStore):
+    """
+    Carts in the Cart and CartItem tables. Discounted prices and totals are
+    computed by the database (see store.pricing.line_total).
+    """
+
+    # only what SimpleProductSerializer shows
+    product_fields = ['product__id', 'product__title', 'product__unit_price']
+
+    def get_items(self):
+        return CartItem.objects.select_related('product').only(
+            'id', 'cart_id', 'product_id', 'quantity', *self.product_fields
+        ).annotate(unit_price=discounted_price_expression(), total_price=line_total()).order_by('id')
+
+    def create(self):
+        cart = Cart.objects.create()
+        cart.items = []
+        cart.total_price = Decimal(0)
+        return cart
+
+    def get(self, cart_id):
+        return Cart.objects.filter(pk=cart_id).annotate(
+            total_price=Coalesce(Sum(line_total('cartitems__')), Decimal(0), output_field=PRICE_FIELD)
+        ).prefetch_related(
+            Prefetch('cartitems', queryset=self.get_items(), to_attr='items')).first()
+
+    def delete(self, cart_id):
+        return Cart.objects.filter(pk=cart_id).delete()[0] > 0
+
+    def claim(self, cart_id):
+        # the row lock makes concurrent checkouts (and item changes) of the cart
+        # wait for this one, they find it deleted; a rollback restores it
+        if not Cart.objects.select_for_update().filter(pk=cart_id).values_list('pk').first():
+            return None
+        lines = self.get_lines(cart_id)
+        self.delete(cart_id)
+        return lines
+
+    def exists(self, cart_id):
+        return Cart.objects.filter(pk=cart_id).exists()
+
+    def get_lines(self, cart_id):
+        if not self.exists(cart_id):
+            return None
+        return list(CartItem.objects.filter(cart_id=cart_id).order_by(
+            'id').values_list('product_id', 'quantity'))
+
+    def get_item(self, cart_id, item_id):
+        return self.get_items().filter(cart_id=cart_id, pk=item_id).first()
+
+    def add_items(self, cart_id, lines):
+        quantities = merge_lines(lines)
+        if not quantities:
+            return []
+        # a single line needs no transaction: when it is not inserted nothing changed
+        with transaction.atomic() if len(quantities) > 1 else nullcontext():
+            if connection.features.supports_update_conflicts_with_target:
+                rows = self.upsert_items(cart_id, quantities)
+            else:
+                rows = self.update_or_create_items(cart_id, quantities)
+            rows = {product_id: (item_id, quantity) for item_id, product_id, quantity in rows}
+            if len(rows) < len(quantities):
+                if len(quantities) > 1:
+                    transaction.set_rollback(True)
+                return None
+            self.touch(cart_id)
+        return [CartItem(id=rows[product_id][0], cart_id=cart_id, product_id=product_id,
+                         quantity=rows[product_id][1])
+                for product_id in quantities]
+
+    def upsert_items(self, cart_id, quantities):
+        # one statement: lines of unknown products (or an unknown cart) are not
+        # inserted, concurrent adds of the same product add up in the database
+        # instead of racing into the (product, cart) unique constraint
+        quote = connection.ops.quote_name
+        item_table, product_table, cart_table = (
+            quote(model._meta.db_table) for model in (CartItem, Product, Cart))
+        db_cart_id = Cart._meta.pk.get_db_prep_value(cart_id, connection)
+        lines = ' UNION ALL '.join(['SELECT %s AS product_id, %s AS quantity'] * len(quantities))
+        sql = (
+            f'INSERT INTO {item_table} (cart_id, product_id, quantity) '
+            f'SELECT %s, line.product_id, line.quantity FROM ({lines}) line '
+            f'JOIN {product_table} product ON product.id = line.product_id '
+            f'WHERE EXISTS (SELECT 1 FROM {cart_table} WHERE id = %s) '
+            f'ON CONFLICT (product_id, cart_id) DO UPDATE '
+            f'SET quantity = {item_table}.quantity + EXCLUDED.quantity'
+        )
+        params = [db_cart_id, *(value for line in quantities.items() for value in line), db_cart_id]
+        with connection.cursor() as cursor:
+            if connection.features.can_return_columns_from_insert:
+                cursor.execute(f'{sql} RETURNING id, product_id, quantity', params)
+                return cursor.fetchall()
+            cursor.execute(sql, params)
+            return CartItem.objects.filter(cart_id=cart_id, product_id__in=quantities).values_list(
+                'id', 'product_id', 'quantity')
+
+    def update_or_create_items(self, cart_id, quantities):
+        # for backends without ON CONFLICT: increment, else insert, and when a
+        # concurrent insert wins the unique constraint, increment that row
+        with transaction.atomic():
+            if not Cart.objects.filter(pk=cart_id).exists():
+                return []
+            known = set(Product.objects.filter(pk__in=quantities).values_list('id', flat=True))
+            for product_id in known:
+                quantity = quantities[product_id]
+                items = CartItem.objects.filter(cart_id=cart_id, product_id=product_id)
+                if items.update(quantity=F('quantity') + quantity):
+                    continue
+                try:
+                    with transaction.atomic():
+                        CartItem.objects.create(
+                            cart_id=cart_id, product_id=product_id, quantity=quantity)
+                except IntegrityError:
+                    items.update(quantity=F('quantity') + quantity)
+            return CartItem.objects.filter(cart_id=cart_id, product_id__in=known).values_list(
+                'id', 'product_id', 'quantity')
+
+    def update_item(self, cart_id, item_id, quantity):
+        cart_item = self.get_item(cart_id, item_id)
+        if cart_item is not None:
+            cart_item.quantity = quantity
+            cart_item.save(update_fields=['quantity'])
+            self.touch(cart_id)
+        return cart_item
+
+    def remove_item(self, cart_id, item_id):
+        removed = CartItem.objects.filter(cart_id=cart_id, pk=item_id).delete()[0] > 0
+        if removed:
+            self.touch(cart_id)
+        return removed
+
+    def touch(self, cart_id):
+        # keeps carts in use away from delete_idle_carts()
+        Cart.objects.filter(pk=cart_id).update(last_activity=timezone.now())
+
+
+class CacheCartStore(CartStore):
+    """
+    Carts as one cache entry each, {'created_at', 'items': {product_id: quantity}},
+    so browsing and filling a cart never writes to the database. Item ids are
+    product ids. Entries expire CART_IDLE_TIMEOUT seconds after the last change.
+    """
+    cache_alias = 'default'
+    product_fields = ['id', 'title', 'unit_price']
+
+    def __init__(self):
+        self.cache = caches[self.cache_alias]
+        self.timeout = settings.CART_IDLE_TIMEOUT
+        # carts taken by claim() until their checkout is over
+        self.claimed = {}
+
+    def get_key(self, cart_id):
+        return f'store:cart:{cart_id}'
+
+    def load(self, cart_id):
+        return self.cache.get(self.get_key(cart_id))
+
+    def change(self, cart_id, change):
+        # read-modify-write under a lock, so concurrent changes are not lost
+        key = self.get_key(cart_id)
+        with cache_lock(key, backend=self.cache):
+            data = self.cache.get(key)
+            if data is None:
+                return None
+            result = change(data['items'])
+            self.cache.set(key, data, self.timeout)
+        return result
+
+    def build_item(self, cart_id, product_id, quantity, product=None):
+        item = CartItem(id=product_id, cart_id=cart_id, product_id=product_id, quantity=quantity)
+        if product is not None:
+            item.product = product
+        return item
+
+    def build_items(self, cart_id, lines):
+        # lines of products deleted since they were added are dropped
+        products = Product.objects.only(*self.product_fields).in_bulk(
+            [product_id for product_id, quantity in lines])
+        return pricing.price_items([
+            self.build_item(cart_id, product_id, quantity, products[product_id])
+            for product_id, quantity in lines if product_id in products])
+
+    def create(self):
+        cart = Cart(id=uuid4(), created_at=timezone.now())
+        self.cache.set(self.get_key(cart.id), {
+                       'created_at': cart.created_at, 'items': {}}, self.timeout)
+        cart.items = []
+        return pricing.price_cart(cart)
+
+    def get(self, cart_id):
+        data = self.load(cart_id)
+        if data is None:
+            return None
+        cart = Cart(id=cart_id, created_at=data['created_at'])
+        cart.items = self.build_items(cart_id, list(data['items'].items()))
+        return pricing.price_cart(cart)
+
+    def delete(self, cart_id):
+        return self.cache.delete(self.get_key(cart_id))
+
+    def claim(self, cart_id):
+        # popped under the cart lock, concurrent checkouts find it gone; the
+        # cache is not part of the transaction, see release()
+        key = self.get_key(cart_id)
+        with cache_lock(key, backend=self.cache):
+            data = self.cache.get(key)
+            if data is None:
+                return None
+            self.cache.delete(key)
+        self.claimed[cart_id] = data
+        return list(data['items'].items())
+
+    def release(self, cart_id):
+        data = self.claimed.pop(cart_id, None)
+        if data is not None:
+            self.cache.add(self.get_key(cart_id), data, self.timeout)
+
+    def get_lines(self, cart_id):
+        data = self.load(cart_id)
+        return None if data is None else list(data['items'].items())
+
+    def get_item(self, cart_id, item_id):
+        data = self.load(cart_id)
+        if data is None or item_id not in data['items']:
+            return None
+        items = self.build_items(cart_id, [(item_id, data['items'][item_id])])
+        return items[0] if items else None
+
+    def add_items(self, cart_id, lines):
+        quantities = merge_lines(lines)
+        if Product.objects.filter(pk__in=quantities).count() < len(quantities):
+            return None
+
+        def add(items):
+            for product_id, quantity in quantities.items():
+                items[product_id] = items.get(product_id, 0) + quantity
+            return [self.build_item(cart_id, product_id, items[product_id])
+                    for product_id in quantities]
+        return self.change(cart_id, add)
+
+    def update_item(self, cart_id, item_id, quantity):
+        def update(items):
+            if item_id in items:
+                items[item_id] = quantity
+                return True
+        if self.change(cart_id, update):
+            return self.get_item(cart_id, item_id)
+        return None
+
+    def remove_item(self, cart_id, item_id):
+        return bool(self.change(cart_id, lambda items: items.pop(item_id, None) is not None))
+
+
+def delete_idle_carts(max_age, batch_size=1000, max_batches=None):
+    """
+    Deletes database carts last changed more than max_age (a timedelta) ago, oldest
+    first, batch_size carts (and their items) per statement and transaction so
+    no delete holds locks for long. Returns the reclaimed row counts.
+    """
+    cutoff = timezone.now() - max_age
+    result = {'carts': 0, 'cart_items': 0, 'batches': 0}
+    while max_batches is None or result['batches'] < max_batches:
+        cart_ids = list(Cart.objects.filter(last_activity__lt=cutoff).order_by(
+            'last_activity').values_list('id', flat=True)[:batch_size])
+        if not cart_ids:
+            break
+        with transaction.atomic():
+            # carts changed since they were selected are kept
+            deleted, counts = Cart.objects.filter(pk__in=cart_ids, last_activity__lt=cutoff).delete()
+        result['carts'] += counts.get(Cart._meta.label, 0)
+        result['cart_items'] += counts.get(CartItem._meta.label, 0)
+        result['batches'] += 1
+    return result
@@ -0,0 +1,41 @@
+from hashlib import md5
+
+from django.utils.cache import get_conditional_response, patch_vary_headers, quote_etag
+from django.utils.http import http_date
+from rest_framework import status
+
+
+def make_etag(*parts):
+    return quote_etag(md5('|'.join(str(part) for part in parts).encode()).hexdigest())
+
+
+class ConditionalGetMixin:
+    """
+    Adds ETag / Last-Modified to list and retrieve responses and answers
+    If-None-Match / If-Modified-Since with a 304 straight from the validators
+    returned by get_validators(), before the response is built or serialized.
+    """
+
+    def get_validators(self, request):
+        """Returns an (etag, last_modified datetime or None) pair."""
+        raise NotImplementedError
+
+    def get_conditional_response(self, view_method, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=timestamp)
+        response = not_modified or view_method(request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            if etag:
+                response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+            patch_vary_headers(response, ['Accept'])
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().retrieve, request, *args, **kwargs)
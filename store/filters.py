@@ -1,5 +1,5 @@
 from django_filters.rest_framework import FilterSet
-from .models import Product
+from .models import Order, Product, Review
 
 
 class ProductFilter(FilterSet):
@@ -9,3 +9,21 @@ class ProductFilter(FilterSet):
             'category_id': ['exact'],  # use default
             'unit_price': ['gt', 'lt'],
         }
+
+
+class ReviewFilter(FilterSet):
+    class Meta:
+        model = Review
+        fields = {
+            'rating': ['exact', 'gte', 'lte'],
+        }
+
+
+class OrderFilter(FilterSet):
+    class Meta:
+        model = Order
+        fields = {
+            'payment_status': ['exact'],
+            'customer_id': ['exact'],
+            'placed_at': ['gte', 'lt'],
+        }
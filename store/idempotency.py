@@ -0,0 +1,86 @@
+from functools import wraps
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .caching import CacheLockTimeout, cache_lock
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyKeyInUse(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this Idempotency-Key is still being processed, retry later.'
+    default_code = 'idempotency_key_in_use'
+
+
+class IdempotencyKeyMismatch(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This Idempotency-Key was already used with a different request.'
+    default_code = 'idempotency_key_mismatch'
+
+
+def idempotency_cache_key(request, key):
+    # keys are scoped to the user and the endpoint, clients only keep them unique per request
+    scope = '|'.join([str(request.user.pk), request.method, request.path, key])
+    return f'store:idempotency:{md5(scope.encode()).hexdigest()}'
+
+
+def request_fingerprint(request):
+    return md5(JSONRenderer().render(request.data)).hexdigest()
+
+
+def replay(stored):
+    response = Response(stored['data'], status=stored['status'], headers=stored['headers'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view_method):
+    """
+    Honours an Idempotency-Key header on a POST view method. The first
+    successful response is kept in the cache for IDEMPOTENCY_KEY_TIMEOUT
+    seconds and replayed to retries with the same key and payload. Concurrent
+    duplicates wait for the first one to finish instead of running again.
+    Errors are not kept, so a retry runs the request again.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return view_method(self, request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise ValidationError(
+                {IDEMPOTENCY_HEADER: [f'Use between 1 and {MAX_KEY_LENGTH} characters.']})
+        cache_key = idempotency_cache_key(request, key)
+        fingerprint = request_fingerprint(request)
+
+        stored = cache.get(cache_key)
+        if stored is None:
+            try:
+                with cache_lock(cache_key, timeout=settings.IDEMPOTENCY_LOCK_TIMEOUT,
+                                wait=settings.IDEMPOTENCY_LOCK_WAIT):
+                    # the request we waited for may have finished it
+                    stored = cache.get(cache_key)
+                    if stored is None:
+                        response = view_method(self, request, *args, **kwargs)
+                        if status.is_success(response.status_code):
+                            cache.set(cache_key, {
+                                'fingerprint': fingerprint,
+                                'status': response.status_code,
+                                'data': response.data,
+                                'headers': dict(response.items()),
+                            }, settings.IDEMPOTENCY_KEY_TIMEOUT)
+                        return response
+            except CacheLockTimeout:
+                raise IdempotencyKeyInUse()
+        if stored['fingerprint'] != fingerprint:
+            raise IdempotencyKeyMismatch()
+        return replay(stored)
+    return wrapper
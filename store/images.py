@@ -0,0 +1,60 @@
+import logging
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# longest side in pixels, images are never scaled up
+VARIANT_SIZES = {
+    'thumbnail': 150,
+    'small': 480,
+    'large': 1200,
+}
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+
+
+def encode(image, image_format):
+    buffer = BytesIO()
+    if image_format == 'WEBP':
+        image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+    elif image_format == 'JPEG':
+        image.convert('RGB').save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    else:
+        image.save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def create_variants(product_image):
+    """
+    Writes every VARIANT_SIZES resize of product_image.image to its storage, in
+    WebP and in the original format (PNG for anything but JPEG), and returns
+    {size: {'webp': name, 'original': name}} of the stored files.
+    """
+    field = product_image.image
+    try:
+        with field.open('rb'), Image.open(field) as source:
+            source.load()
+            fallback_format = 'JPEG' if source.format == 'JPEG' else 'PNG'
+            source = ImageOps.exif_transpose(source)
+    except (OSError, UnidentifiedImageError):
+        logger.warning('Cannot read product image %s', product_image.pk, exc_info=True)
+        return {}
+
+    if source.mode not in ('RGB', 'RGBA'):
+        source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+    directory = os.path.join(os.path.dirname(field.name), 'variants', str(product_image.pk))
+    variants = {}
+    for size, pixels in VARIANT_SIZES.items():
+        image = source.copy()
+        image.thumbnail((pixels, pixels), Image.Resampling.LANCZOS)
+        variants[size] = {
+            name: field.storage.save(
+                os.path.join(directory, f'{size}.{image_format.lower()}'),
+                ContentFile(encode(image, image_format)))
+            for name, image_format in [('webp', 'WEBP'), ('original', fallback_format)]
+        }
+    return variants
@@ -0,0 +1,42 @@
+from timeit import repeat
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from store.models import Product
+from store.row_serializers import ProductRowSerializer
+from store.serializers import ProductSerializer
+
+
+class Command(BaseCommand):
+    help = 'Times ProductSerializer against the values() row path used by product listings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=1000,
+                            help='Number of products serialized per run')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Runs per path, the fastest one is reported')
+
+    def handle(self, *args, **options):
+        queryset = Product.objects.defer(
+            'search_vector').order_by('id')[:options['limit']]
+
+        def with_serializer():
+            return ProductSerializer(queryset.prefetch_related('images'), many=True).data
+
+        def with_rows():
+            row_serializer = ProductRowSerializer(ProductSerializer())
+            return row_serializer.serialize(row_serializer.get_rows(queryset))
+
+        renderer = JSONRenderer()
+        if renderer.render(with_serializer()) != renderer.render(with_rows()):
+            raise CommandError('The two paths produced different output.')
+
+        count = len(with_rows())
+        serializer_time = min(
+            repeat(with_serializer, number=1, repeat=options['repeat']))
+        rows_time = min(repeat(with_rows, number=1, repeat=options['repeat']))
+        self.stdout.write(f'{count} products, best of {options["repeat"]} runs')
+        self.stdout.write(f'ProductSerializer:    {serializer_time * 1000:.1f} ms')
+        self.stdout.write(f'ProductRowSerializer: {rows_time * 1000:.1f} ms')
+        self.stdout.write(f'Speedup:              {serializer_time / rows_time:.1f}x')
@@ -0,0 +1,41 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from store.bulk import ProductImporter, get_import_format, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Streams products from a CSV or JSON lines file into the catalog, upserting on slug'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int,
+                            default=ProductImporter.batch_size)
+        parser.add_argument('--create-categories', action='store_true',
+                            help='Create categories that do not exist yet instead of rejecting their rows')
+
+    def handle(self, *args, **options):
+        try:
+            file_format = get_import_format(
+                options['path'], options['format'])
+        except ValidationError as error:
+            raise CommandError(error.messages[0])
+
+        def report(result):
+            self.stdout.write(
+                f'{result["rows"]} rows: {result["created"]} created, '
+                f'{result["updated"]} updated, {result["failed"]} failed')
+
+        importer = ProductImporter(
+            batch_size=options['batch_size'],
+            create_categories=options['create_categories'],
+            progress=report
+        )
+        with open(options['path'], 'rb') as stream:
+            result = importer.run(read_rows(stream, file_format))
+
+        for error in result['errors']:
+            self.stderr.write(f'line {error["line"]}: {error["errors"]}')
+        self.stdout.write(self.style.SUCCESS('Import finished.'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.models import Category
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored product_count of every category'
+
+    def handle(self, *args, **options):
+        updated = Category.objects.all().refresh_product_count()
+        self.stdout.write(f'Rebuilt product counts for {updated} categories.')
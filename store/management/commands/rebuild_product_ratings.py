@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored rating average, count and histogram of every product'
+
+    def handle(self, *args, **options):
+        updated = Product.objects.all().refresh_ratings()
+        self.stdout.write(f'Rebuilt ratings for {updated} products.')
@@ -1,8 +1,18 @@
 from django.core.management.base import BaseCommand
-from django.db import connection
+from django.db import connection, transaction
 from pathlib import Path
 import os
 
+from store.models import Category, Product
+from store.search import reindex_products
+
+# columns added after seed.sql was written, given a database default while it runs
+SEED_COLUMN_DEFAULTS = {
+    'store_category': {'product_count': 0},
+    'store_product': {'rating_avg': 0, 'rating_count': 0, 'rating_1': 0, 'rating_2': 0,
+                      'rating_3': 0, 'rating_4': 0, 'rating_5': 0},
+}
+
 
 class Command(BaseCommand):
     help = 'Populates the database with collections and products'
@@ -13,5 +23,17 @@ class Command(BaseCommand):
         file_path = os.path.join(current_dir, 'seed.sql')
         sql = Path(file_path).read_text()
 
-        with connection.cursor() as cursor:
+        with transaction.atomic(), connection.cursor() as cursor:
+            for table, defaults in SEED_COLUMN_DEFAULTS.items():
+                for column, default in defaults.items():
+                    cursor.execute(
+                        f'ALTER TABLE {table} ALTER COLUMN {column} SET DEFAULT %s', [default])
             cursor.execute(sql)
+            for table, defaults in SEED_COLUMN_DEFAULTS.items():
+                for column in defaults:
+                    cursor.execute(
+                        f'ALTER TABLE {table} ALTER COLUMN {column} DROP DEFAULT')
+
+        # raw inserts skip the signals that maintain derived columns
+        Category.objects.all().refresh_product_count()
+        reindex_products(Product.objects.all())
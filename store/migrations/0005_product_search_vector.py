@@ -0,0 +1,65 @@
+# Generated by Django 4.1.3 on 2026-10-17 23:38
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+import store.validators
+
+
+SEARCH_INDEX = django.contrib.postgres.indexes.GinIndex(
+    fields=['search_vector'], name='store_product_search_gin')
+
+
+# tsvector/GIN only exist on PostgreSQL, other backends use the in-process index
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.add_index(apps.get_model('store', 'Product'), SEARCH_INDEX)
+    schema_editor.execute(
+        """
+        UPDATE store_product p
+        SET search_vector =
+            setweight(to_tsvector('simple', coalesce(p.title, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(p.description, '')), 'B') ||
+            setweight(to_tsvector('simple', coalesce(c.title, '')), 'C')
+        FROM store_category c
+        WHERE c.id = p.category_id
+        """
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.remove_index(apps.get_model('store', 'Product'), SEARCH_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_productimage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(upload_to='store/products/images', validators=[store.validators.validate_file_size]),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='product',
+                    index=SEARCH_INDEX,
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(create_search_index, drop_search_index),
+            ],
+        ),
+    ]
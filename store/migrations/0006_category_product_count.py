@@ -0,0 +1,28 @@
+# Generated by Django 4.1.3 on 2026-10-17 23:41
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_products(apps, schema_editor):
+    Category = apps.get_model('store', 'Category')
+    Product = apps.get_model('store', 'Product')
+    counts = Product.objects.filter(category=models.OuterRef('pk')).order_by(
+    ).values('category').annotate(count=models.Count('pk')).values('count')
+    Category.objects.update(product_count=Coalesce(models.Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_products, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 4.1.3 on 2026-10-17 23:53
+
+from django.db import migrations, models
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+
+def rate_products(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    Review = apps.get_model('store', 'Review')
+
+    def count(star):
+        counts = Review.objects.filter(product=models.OuterRef('pk'), rating=star).order_by(
+        ).values('product').annotate(count=models.Count('pk')).values('count')
+        return Coalesce(models.Subquery(counts), 0)
+    Product.objects.update(**{f'rating_{star}': count(star) for star in range(1, 6)})
+
+    total = sum(models.F(f'rating_{star}') * star for star in range(1, 6))
+    Product.objects.update(rating_count=sum(models.F(f'rating_{star}') for star in range(1, 6)))
+    average = Cast(Cast(total, models.FloatField()) / NullIf(models.F('rating_count'), 0),
+                   models.DecimalField(max_digits=3, decimal_places=2))
+    Product.objects.update(rating_avg=Coalesce(average, 0, output_field=models.DecimalField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_productimage_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=3),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['rating_avg', 'id'], name='store_product_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'rating_avg', 'id'], name='store_product_cat_rating_idx'),
+        ),
+        migrations.RunPython(rate_products, migrations.RunPython.noop),
+    ]
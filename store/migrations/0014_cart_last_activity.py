@@ -0,0 +1,30 @@
+# Generated by Django 4.1.3 on 2026-10-18 00:32
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def backfill_last_activity(apps, schema_editor):
+    Cart = apps.get_model('store', 'Cart')
+    Cart.objects.update(last_activity=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_order_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='last_activity',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_last_activity, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='cart',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+    ]
@@ -1,9 +1,14 @@
 from uuid import uuid4
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Cast, Coalesce, NullIf
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.conf import settings
 from django.contrib import admin
+from django.utils import timezone
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 
+from store.caching import bump_catalog_version
 from store.validators import validate_file_size
 
 
@@ -16,10 +21,22 @@ class Promotion(models.Model):
         return self.title
 
 
+class CategoryQuerySet(models.QuerySet):
+    def refresh_product_count(self):
+        # recompute the stored counters from the product table in one UPDATE
+        counts = Product.objects.filter(category=models.OuterRef('pk')).order_by(
+        ).values('category').annotate(count=models.Count('pk')).values('count')
+        return self.update(product_count=Coalesce(models.Subquery(counts), 0))
+
+
 class Category(models.Model):
     title = models.CharField(max_length=255)
     featured_product = models.ForeignKey(
         'Product', on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    # maintained by store.signals and ProductQuerySet, rebuilt by `manage.py rebuild_product_counts`
+    product_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CategoryQuerySet.as_manager()
 
     class Meta:
         ordering = ['title']
@@ -29,6 +46,106 @@ class Category(models.Model):
         return self.title
 
 
+RATING_STARS = range(1, 6)
+
+
+def rating_histogram_field(star):
+    return f'rating_{star}'
+
+
+class ProductQuerySet(models.QuerySet):
+    # bulk writes skip save signals, so they refresh the affected category
+    # counters and invalidate the cached catalog themselves
+    # columns that are not part of the product payload, writing only them keeps last_updated
+    untimestamped_fields = {'search_vector'}
+
+    def update(self, **kwargs):
+        # update() does not apply auto_now, but the product ETag/Last-Modified
+        # (ProductViewSet.get_validators) rely on last_updated moving with the payload
+        if kwargs.keys() - self.untimestamped_fields:
+            kwargs.setdefault('last_updated', timezone.now())
+        if 'category' not in kwargs and 'category_id' not in kwargs:
+            rows = super().update(**kwargs)
+        else:
+            with transaction.atomic(using=self.db):
+                category_ids = set(self.order_by().values_list(
+                    'category_id', flat=True).distinct())
+                rows = super().update(**kwargs)
+                category = kwargs.get('category', kwargs.get('category_id'))
+                if isinstance(category, models.Model):
+                    category_ids.add(category.pk)
+                elif isinstance(category, int):
+                    category_ids.add(category)
+                else:
+                    # an expression (bulk_update's CASE), read back where rows went
+                    category_ids.update(self.order_by().values_list(
+                        'category_id', flat=True).distinct())
+                Category.objects.filter(
+                    pk__in=category_ids).refresh_product_count()
+        bump_catalog_version()
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            Category.objects.filter(
+                pk__in={obj.category_id for obj in objs}).refresh_product_count()
+        bump_catalog_version()
+        return objs
+
+    def reserve_inventory(self, quantities):
+        """
+        Takes {product_id: quantity} out of inventory with one conditional
+        UPDATE per product, so concurrent checkouts never read-modify-write a
+        row and never oversell. Products are updated in id order: concurrent
+        reservations lock rows in the same order and cannot deadlock. Returns
+        the ids of the products that did not have enough left, the caller has
+        to roll its transaction back then.
+        """
+        now = timezone.now()
+        short = []
+        for product_id in sorted(quantities):
+            quantity = quantities[product_id]
+            rows = super(ProductQuerySet, self.filter(pk=product_id, inventory__gte=quantity)).update(
+                inventory=models.F('inventory') - quantity, last_updated=now)
+            if not rows:
+                short.append(product_id)
+        bump_catalog_version()
+        return short
+
+    def update_ratings(self, **histogram):
+        """
+        Sets rating_1..rating_5 to the given expressions (missing stars keep
+        their value) and recomputes rating_count and rating_avg from them in
+        the same UPDATE. Touches last_updated, ratings are part of the payload.
+        """
+        histogram = {rating_histogram_field(star): histogram.get(
+            rating_histogram_field(star), models.F(rating_histogram_field(star))) for star in RATING_STARS}
+        count = sum(histogram.values())
+        total = sum(value * star for star, value in zip(RATING_STARS, histogram.values()))
+        average = Cast(Cast(total, models.FloatField()) / NullIf(count, 0),
+                       models.DecimalField(max_digits=3, decimal_places=2))
+        return self.update(
+            **histogram,
+            rating_count=count,
+            rating_avg=Coalesce(average, 0, output_field=models.DecimalField()),
+            last_updated=timezone.now(),
+        )
+
+    def change_rating(self, star, delta):
+        # one review added (delta=1) or removed (delta=-1)
+        field = rating_histogram_field(star)
+        return self.update_ratings(**{field: models.F(field) + delta})
+
+    def refresh_ratings(self):
+        # recompute the stored histograms from the review table
+        def count(star):
+            counts = Review.objects.filter(product=models.OuterRef('pk'), rating=star).order_by(
+            ).values('product').annotate(count=models.Count('pk')).values('count')
+            return Coalesce(models.Subquery(counts), 0)
+        return self.update_ratings(**{rating_histogram_field(star): count(star) for star in RATING_STARS})
+
+
 class Product(models.Model):
     title = models.CharField(max_length=255)
     slug = models.SlugField()
@@ -40,13 +157,47 @@ class Product(models.Model):
     category = models.ForeignKey(
         Category, on_delete=models.PROTECT, related_name='products')
     promotions = models.ManyToManyField(Promotion, blank=True)
+    # full-text document over title, description and category title (see store/search.py)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # maintained by store.signals as reviews change, rebuilt by `manage.py rebuild_product_ratings`
+    rating_avg = models.DecimalField(
+        max_digits=3, decimal_places=2, default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = ProductQuerySet.as_manager()
 
     class Meta:
         ordering = ['title']
+        indexes = [
+            GinIndex(fields=['search_vector'], name='store_product_search_gin'),
+            # one index per ordering the list allows (id breaks ties for cursor pages),
+            # alone and behind the category filter; unit_price ones also serve price ranges
+            models.Index(fields=['title', 'id'], name='store_product_title_idx'),
+            models.Index(fields=['unit_price', 'id'], name='store_product_price_idx'),
+            models.Index(fields=['last_updated', 'id'], name='store_product_updated_idx'),
+            models.Index(fields=['category', 'title', 'id'], name='store_product_cat_title_idx'),
+            models.Index(fields=['category', 'unit_price', 'id'], name='store_product_cat_price_idx'),
+            models.Index(fields=['category', 'last_updated', 'id'], name='store_product_cat_updated_idx'),
+            models.Index(fields=['rating_avg', 'id'], name='store_product_rating_idx'),
+            models.Index(fields=['category', 'rating_avg', 'id'], name='store_product_cat_rating_idx'),
+        ]
 
     def __str__(self) -> str:
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember the stored category so a move can adjust both counters
+        if 'category_id' in instance.__dict__:
+            instance._loaded_category_id = instance.category_id
+        return instance
+
 
 class ProductImage(models.Model):
     product = models.ForeignKey(
@@ -55,6 +206,9 @@ class ProductImage(models.Model):
     )
     image = models.ImageField(
         upload_to='store/products/images', validators=[validate_file_size])
+    # storage names of the resized copies, {size: {'webp': name, 'original': name}},
+    # filled in by store.tasks.create_image_variants_task after the upload
+    variants = models.JSONField(default=dict, blank=True, editable=False)
 
 
 class Customer(models.Model):
@@ -122,6 +276,15 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['placed_at', 'customer']
+        # keyset pages of the staff order list, newest first (see OrderCursorPagination),
+        # unfiltered, by payment status or by customer
+        indexes = [
+            models.Index(fields=['placed_at', 'id'], name='store_order_placed_idx'),
+            models.Index(fields=['payment_status', 'placed_at', 'id'],
+                         name='store_order_status_placed_idx'),
+            models.Index(fields=['customer', 'placed_at', 'id'],
+                         name='store_order_cust_placed_idx'),
+        ]
 
 
 class OrderItem(models.Model):
@@ -133,6 +296,30 @@ class OrderItem(models.Model):
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
 
 
+class Checkout(models.Model):
+    # an order placement queued by a `Prefer: respond-async` POST /store/orders/,
+    # placed by store.tasks.place_order_task
+    PENDING = 'P'
+    COMPLETE = 'C'
+    FAILED = 'F'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (COMPLETE, 'Complete'),
+        (FAILED, 'Failed'),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid4)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='checkouts')
+    cart_id = models.UUIDField()
+    status = models.CharField(
+        max_length=1, choices=STATUS_CHOICES, default=PENDING)
+    order = models.OneToOneField(
+        Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='checkout')
+    # validation errors of a failed placement, as the synchronous checkout returns them
+    errors = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
 class Address(models.Model):
     street = models.CharField(max_length=255)
     city = models.CharField(max_length=255)
@@ -143,6 +330,8 @@ class Address(models.Model):
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
+    # moved by every item change, indexed for the oldest-first idle cart cleanup (store.tasks)
+    last_activity = models.DateTimeField(default=timezone.now, db_index=True)
 
 
 class CartItem(models.Model):
@@ -175,3 +364,18 @@ class Review(models.Model):
         on_delete=models.CASCADE,
         related_name='reviews'
     )
+
+    class Meta:
+        indexes = [
+            # newest-first pages per product, and the top reviews (best, then newest)
+            models.Index(fields=['product', 'date', 'id'], name='store_review_product_date_idx'),
+            models.Index(fields=['product', 'rating', 'date', 'id'], name='store_review_rating_date_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember the stored rating so an edit can move it between histogram buckets
+        if 'rating' in instance.__dict__ and 'product_id' in instance.__dict__:
+            instance._loaded_rating = (instance.product_id, instance.rating)
+        return instance
@@ -1,5 +1,56 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, CursorPagination
+
+
+class ProductCursorPagination(CursorPagination):
+    page_size = 10
+    # orderings a cursor can be keyed on, id is always appended as tie-breaker
+    ordering_fields = ['title', 'unit_price', 'last_updated', 'rating_avg']
+    default_ordering = 'title'
+    ordering_param = 'ordering'
+
+    def get_ordering(self, request, queryset, view):
+        # only the first ?ordering= term is used since the cursor is keyed on one column
+        ordering = request.query_params.get(self.ordering_param, '')
+        field = ordering.split(',')[0].strip()
+        if field.lstrip('-') not in self.ordering_fields:
+            field = self.default_ordering
+        tie_breaker = '-id' if field.startswith('-') else 'id'
+        return (field, tie_breaker)
+
+
+class ReviewCursorPagination(CursorPagination):
+    page_size = 20
+    # newest first, served by the (product, date, id) index
+    ordering = ('-date', '-id')
+
+
+class OrderCursorPagination(CursorPagination):
+    page_size = 50
+    # newest first, served by the (..., placed_at, id) order indexes
+    ordering = ('-placed_at', '-id')
 
 
 class ProductPagination(PageNumberPagination):
     page_size = 10
+    # ?pagination=cursor switches to keyset pages (no COUNT(*), no OFFSET scan)
+    mode_query_param = 'pagination'
+    cursor_mode = 'cursor'
+    cursor_pagination_class = ProductCursorPagination
+
+    def is_cursor_request(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == self.cursor_mode or
+            self.cursor_pagination_class.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.is_cursor_request(request):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
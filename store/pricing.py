@@ -0,0 +1,106 @@
+from decimal import ROUND_HALF_UP, Decimal
+from threading import Lock
+
+from django.db.models import DecimalField, F, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Coalesce, Least, Round
+
+from .caching import get_promotion_version
+from .models import Product
+
+CENT = Decimal('0.01')
+# prices and totals are rounded to cents like unit_price
+PRICE_FIELD = DecimalField(max_digits=12, decimal_places=2)
+DISCOUNT_FIELD = DecimalField(max_digits=9, decimal_places=4)
+
+
+def discounted_price(unit_price, discount):
+    """unit_price less discount percent (Promotion.discount), rounded to cents."""
+    discount = min(Decimal(discount), Decimal(100))
+    return (unit_price * (100 - discount) / 100).quantize(CENT, ROUND_HALF_UP)
+
+
+def best_discount(product_id):
+    """The best discount of the product whose id the outer query has at product_id, in SQL."""
+    discounts = Product.promotions.through.objects.filter(product_id=OuterRef(product_id)).order_by(
+    ).values('product_id').annotate(discount=Max('promotion__discount')).values('discount')
+    return Coalesce(Cast(Subquery(discounts), DISCOUNT_FIELD), Value(Decimal(0)),
+                    output_field=DISCOUNT_FIELD)
+
+
+def discounted_price_expression(prefix=''):
+    """discounted_price() of the product at prefix + 'product', in SQL."""
+    discount = Least(best_discount(f'{prefix}product_id'), Value(Decimal(100)))
+    price = F(f'{prefix}product__unit_price') * (Value(Decimal(100)) - discount) / Value(Decimal(100))
+    return Cast(Round(price, 2), PRICE_FIELD)
+
+
+def line_total(prefix=''):
+    """Discounted unit price times quantity of the cart item at prefix, in SQL."""
+    return Cast(F(f'{prefix}quantity') * discounted_price_expression(prefix), PRICE_FIELD)
+
+
+class PromotionPricing:
+    """
+    Resolves the best (largest) promotion discount of products with one query
+    for all products not seen yet. Discounts are kept in process until the
+    promotion version changes, which store.signals bumps on any promotion or
+    Product.promotions change.
+    """
+    max_entries = 10000
+
+    def __init__(self):
+        self.lock = Lock()
+        self.version = None
+        self.discounts = {}
+
+    def get_discounts(self, product_ids):
+        version = get_promotion_version()
+        with self.lock:
+            if version != self.version:
+                self.version, self.discounts = version, {}
+            discounts = self.discounts
+        # answered from a local copy, the shared dict may be cleared meanwhile
+        found = {}
+        for product_id in product_ids:
+            discount = discounts.get(product_id)
+            if discount is not None:
+                found[product_id] = discount
+        missing = {product_id for product_id in product_ids if product_id not in found}
+        if missing:
+            best = dict(Product.promotions.through.objects.filter(
+                product_id__in=missing).values('product_id').annotate(
+                discount=Max('promotion__discount')).values_list('product_id', 'discount'))
+            loaded = {product_id: Decimal(str(best.get(product_id, 0))) for product_id in missing}
+            found.update(loaded)
+            with self.lock:
+                if len(discounts) + len(loaded) > self.max_entries:
+                    discounts.clear()
+                discounts.update(loaded)
+        return {product_id: found[product_id] for product_id in product_ids}
+
+    def get_prices(self, products):
+        """{product id: discounted unit price} for products with a loaded unit_price."""
+        products = list(products)
+        discounts = self.get_discounts([product.id for product in products])
+        return {product.id: discounted_price(product.unit_price, discounts[product.id])
+                for product in products}
+
+    def get_price(self, product):
+        return self.get_prices([product])[product.id]
+
+    def price_items(self, items):
+        """Sets unit_price and total_price on cart items with a loaded product."""
+        prices = self.get_prices({item.product_id: item.product for item in items}.values())
+        for item in items:
+            item.unit_price = prices[item.product_id]
+            item.total_price = item.quantity * item.unit_price
+        return items
+
+    # database carts are priced by the line_total() annotations (see carts.py)
+    def price_cart(self, cart):
+        self.price_items(cart.items)
+        cart.total_price = sum((item.total_price for item in cart.items), Decimal(0))
+        return cart
+
+
+pricing = PromotionPricing()
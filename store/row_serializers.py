@@ -0,0 +1,118 @@
+from collections import defaultdict
+
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from .models import RATING_STARS, ProductImage, rating_histogram_field
+from .pricing import discounted_price, pricing
+from .serializers import TAX_MULTIPLIER
+
+
+class RowSerializer:
+    """
+    Serializes ``values()`` rows to exactly what ``serializer`` outputs for the
+    matching model instances, without building instances or walking the
+    serializer fields for every row. The plan of per-field writers is built
+    once from the (possibly ?fields= trimmed) serializer.
+    """
+
+    def __init__(self, serializer, extra_columns=()):
+        self.serializer = serializer
+        self.model = serializer.Meta.model
+        self.request = serializer.context.get('request')
+        self.plan = []
+        columns = set(extra_columns)
+        for name, field in serializer.fields.items():
+            field_columns, writer = self.get_writer(name, field)
+            columns.update(field_columns)
+            self.plan.append((name, writer))
+        self.columns = ['id'] + sorted(columns - {'id'})
+
+    def get_writer(self, name, field):
+        """Returns (columns read, function turning a row into the field value)."""
+        source = field.source
+        if isinstance(field, serializers.PrimaryKeyRelatedField):
+            return [source], lambda row: row[source]
+        if isinstance(field, serializers.FileField):
+            storage = self.model._meta.get_field(source).storage
+            return [source], lambda row: self.get_file_url(storage, row[source])
+        self.model._meta.get_field(source)  # only plain columns can be read from rows
+        to_representation = field.to_representation
+
+        def write(row):
+            value = row[source]
+            return None if value is None else to_representation(value)
+        return [source], write
+
+    def get_file_url(self, storage, name):
+        if not name:
+            return None
+        url = storage.url(name)
+        if self.request is not None:
+            return self.request.build_absolute_uri(url)
+        return url
+
+    def get_rows(self, queryset):
+        # prefetches are replaced by the one-pass grouping in prepare()
+        return queryset.prefetch_related(None).values(*self.columns)
+
+    def prepare(self, rows):
+        """Hook to load related data for a whole page of rows at once."""
+
+    def serialize(self, rows):
+        rows = list(rows)
+        self.prepare(rows)
+        plan = self.plan
+        return [{name: write(row) for name, write in plan} for row in rows]
+
+
+class ProductRowSerializer(RowSerializer):
+    def get_writer(self, name, field):
+        if name == 'price_inc_tax':
+            self.prices = {}
+            return ['unit_price'], lambda row: self.prices[row['id']] * TAX_MULTIPLIER
+        if name == 'rating_histogram':
+            columns = {str(star): rating_histogram_field(star) for star in RATING_STARS}
+            return columns.values(), lambda row: {star: row[column] for star, column in columns.items()}
+        if name == 'images':
+            self.image_serializer = RowSerializer(field.child)
+            return [], lambda row: self.images.get(row['id'], [])
+        return super().get_writer(name, field)
+
+    def prepare(self, rows):
+        if hasattr(self, 'prices'):
+            # discounts for the whole page at once
+            discounts = pricing.get_discounts([row['id'] for row in rows])
+            self.prices = {row['id']: discounted_price(row['unit_price'], discounts[row['id']])
+                           for row in rows}
+        if not hasattr(self, 'image_serializer'):
+            return
+        images = list(ProductImage.objects.filter(
+            product_id__in=[row['id'] for row in rows]
+        ).order_by('id').values('product_id', *self.image_serializer.columns))
+        self.images = defaultdict(list)
+        for image, row in zip(self.image_serializer.serialize(images), images):
+            self.images[row['product_id']].append(image)
+
+
+class RowListMixin:
+    """
+    ModelViewSet.list() replacement that reads values() rows and serializes them
+    with row_serializer_class instead of the serializer's per-instance path.
+    """
+    row_serializer_class = RowSerializer
+    # columns that must be read although they are not serialized (e.g. cursor ordering)
+    row_extra_columns = ()
+
+    def get_row_serializer(self):
+        return self.row_serializer_class(self.get_serializer(), self.row_extra_columns)
+
+    def list(self, request, *args, **kwargs):
+        row_serializer = self.get_row_serializer()
+        rows = row_serializer.get_rows(
+            self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(row_serializer.serialize(page))
+        return Response(row_serializer.serialize(rows))
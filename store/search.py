@@ -0,0 +1,143 @@
+import re
+from bisect import bisect_left
+from threading import Lock
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import Case, Count, F, FloatField, Max, OuterRef, Subquery, Value, When
+from rest_framework.filters import SearchFilter
+
+from .models import Category, Product
+
+# 'simple' keeps words unstemmed so prefix queries behave the same while typing
+SEARCH_CONFIG = 'simple'
+# same relative weights postgres' ts_rank uses for A, B and C labels
+WEIGHTS = {'A': 1.0, 'B': 0.4, 'C': 0.2}
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall((text or '').lower())
+
+
+def uses_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def product_search_vector():
+    category_title = Subquery(
+        Category.objects.filter(pk=OuterRef('category_id')).values('title')[:1])
+    return (
+        SearchVector('title', weight='A', config=SEARCH_CONFIG) +
+        SearchVector('description', weight='B', config=SEARCH_CONFIG) +
+        SearchVector(category_title, weight='C', config=SEARCH_CONFIG)
+    )
+
+
+class InvertedIndex:
+    """
+    In-process token -> {product_id: score} index used when the database has
+    no full-text support (SQLite test runs). It is rebuilt whenever the product
+    table fingerprint changes or a save/delete signal invalidates it.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.invalidate()
+
+    def invalidate(self):
+        self.postings = {}
+        self.vocabulary = []
+        self.fingerprint = None
+
+    def get_fingerprint(self):
+        return tuple(Product.objects.order_by().aggregate(
+            count=Count('id'), max_id=Max('id'), last_updated=Max('last_updated')
+        ).values())
+
+    def build(self, fingerprint):
+        postings = {}
+        rows = Product.objects.order_by().values_list(
+            'id', 'title', 'description', 'category__title')
+        for (product_id, *fields) in rows:
+            for text, weight in zip(fields, WEIGHTS.values()):
+                for token in tokenize(text):
+                    scores = postings.setdefault(token, {})
+                    scores[product_id] = scores.get(product_id, 0) + weight
+        self.postings = postings
+        self.vocabulary = sorted(postings)
+        self.fingerprint = fingerprint
+
+    def ensure_current(self):
+        fingerprint = self.get_fingerprint()
+        with self.lock:
+            if fingerprint != self.fingerprint:
+                self.build(fingerprint)
+
+    def match_prefix(self, term):
+        # every indexed token starting with term, found by bisecting the sorted vocabulary
+        scores = {}
+        index = bisect_left(self.vocabulary, term)
+        while index < len(self.vocabulary) and self.vocabulary[index].startswith(term):
+            for product_id, score in self.postings[self.vocabulary[index]].items():
+                scores[product_id] = scores.get(product_id, 0) + score
+            index += 1
+        return scores
+
+    def search(self, terms):
+        self.ensure_current()
+        results = None
+        for term in terms:
+            scores = self.match_prefix(term)
+            if results is None:
+                results = scores
+            else:
+                # all terms must match, like the AND of a tsquery
+                results = {
+                    product_id: results[product_id] + score
+                    for product_id, score in scores.items()
+                    if product_id in results
+                }
+            if not results:
+                return {}
+        return results or {}
+
+
+search_index = InvertedIndex()
+
+
+def reindex_products(queryset):
+    """Refreshes the stored search document of the given products."""
+    if uses_postgres():
+        queryset.order_by().update(search_vector=product_search_vector())
+    else:
+        search_index.invalidate()
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    Drop-in replacement for SearchFilter on ?search= that matches every term as
+    a word prefix against the indexed document and orders results by relevance.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = tokenize(' '.join(self.get_search_terms(request)))
+        if not terms:
+            return queryset
+        if uses_postgres():
+            query = SearchQuery(
+                ' & '.join(f'{term}:*' for term in terms),
+                search_type='raw',
+                config=SEARCH_CONFIG
+            )
+            queryset = queryset.filter(search_vector=query).annotate(
+                search_rank=SearchRank(F('search_vector'), query))
+        else:
+            scores = search_index.search(terms)
+            queryset = queryset.filter(pk__in=scores).annotate(
+                search_rank=Case(
+                    *[When(pk=pk, then=Value(score)) for pk, score in scores.items()],
+                    default=Value(0.0),
+                    output_field=FloatField()
+                ))
+        return queryset.order_by('-search_rank', *Product._meta.ordering, 'id')
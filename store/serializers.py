@@ -4,7 +4,42 @@ from django.db import transaction
 from rest_framework import serializers
 from django.conf import settings
 
-from .models import CartItem, Category, Customer, Order, OrderItem, Product, Review, Cart, ProductImage
+from .models import CartItem, Category, Checkout, Customer, Order, OrderItem, Product, Review, Cart, ProductImage
+from .models import RATING_STARS, rating_histogram_field
+from .carts import get_cart_store
+from .pricing import pricing
+
+# built once instead of per product, the exact value Decimal(1.1) always had
+TAX_MULTIPLIER = Decimal(1.1)
+
+
+def get_requested_fields(query_params, field_names):
+    """
+    Names out of field_names selected by ?fields= (keep only) and ?omit= (drop),
+    both comma separated, in their original order. Unknown names are a 400.
+    """
+    def parse(param):
+        names = {name.strip() for name in query_params.get(param, '').split(',') if name.strip()}
+        unknown = names.difference(field_names)
+        if unknown:
+            raise serializers.ValidationError(
+                {param: [f'Unknown fields: {", ".join(sorted(unknown))}.']})
+        return names
+
+    fields, omit = parse('fields'), parse('omit')
+    return [name for name in field_names
+            if (not fields or name in fields) and name not in omit]
+
+
+class SparseFieldsMixin:
+    # trims the serialized fields on GET requests according to ?fields= and ?omit=
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return fields
+        requested = get_requested_fields(request.query_params, fields)
+        return {name: fields[name] for name in requested}
 
 
 class SimpleProductSerializer(serializers.ModelSerializer):
@@ -12,6 +47,14 @@ class SimpleProductSerializer(serializers.ModelSerializer):
         model = Product
         fields = ['id', 'title', 'unit_price']
 
+    # nested under every cart and order item, so skip the generic per-field walk
+    def to_representation(self, product):
+        return {
+            'id': product.id,
+            'title': product.title,
+            'unit_price': self.fields['unit_price'].to_representation(product.unit_price),
+        }
+
 
 class OrderItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer()
@@ -26,34 +69,60 @@ class AddOrderSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
 
     def validate_cart_id(self, value):
+        lines = get_cart_store().get_lines(value)
         # check if cart exists
-        if not Cart.objects.filter(pk=value).exists():
+        if lines is None:
             raise serializers.ValidationError(
                 'This cart does not exist.')
         # check if cart is empty (has no cart items associated with it)
-        if CartItem.objects.filter(cart_id=value).count() == 0:
+        if not lines:
             raise serializers.ValidationError(
                 'This cart is empty.')
         return value
 
+    # the cart store is only turned into rows here: the cart is claimed in the
+    # order transaction, so concurrent checkouts of one cart place one order
     def save(self, **kwargs):
+        cart_store = get_cart_store()
+        cart_id = self.validated_data['cart_id']
+        try:
+            return self.place_order(cart_store, cart_id)
+        except BaseException:
+            cart_store.release(cart_id)
+            raise
+
+    def place_order(self, cart_store, cart_id):
         with transaction.atomic():
-            cart_id = self.validated_data['cart_id']
             customer = Customer.objects.get(
                 user_id=self.context['user_id'])
+            lines = cart_store.claim(cart_id)
+            if lines is None:
+                raise serializers.ValidationError({'cart_id': ['This cart does not exist.']})
+            if not lines:
+                raise serializers.ValidationError({'cart_id': ['This cart is empty.']})
+            products = Product.objects.only('id', 'unit_price').in_bulk(
+                [product_id for product_id, quantity in lines])
+            # all or nothing: raising rolls back the lines already reserved
+            short = Product.objects.reserve_inventory(
+                {product_id: quantity for product_id, quantity in lines if product_id in products})
+            if short:
+                raise serializers.ValidationError({'products': {
+                    product_id: [f'Only {inventory} of "{title}" left in stock.']
+                    for product_id, title, inventory in Product.objects.filter(
+                        pk__in=short).order_by('id').values_list('id', 'title', 'inventory')
+                }})
             order = Order.objects.create(customer=customer)
-            cart_items = CartItem.objects.select_related(
-                'product').filter(cart=cart_id)
+            # the order keeps the price paid, promotions included
+            prices = pricing.get_prices(products.values())
             # using list comprehension to create list of order items from list of cart items
             order_items = [
                 OrderItem(
                     order=order,
-                    product=item.product,
-                    unit_price=item.product.unit_price,
-                    quantity=item.quantity
-                ) for item in cart_items]
+                    product=products[product_id],
+                    unit_price=prices[product_id],
+                    quantity=quantity
+                ) for product_id, quantity in lines if product_id in products]
             OrderItem.objects.bulk_create(order_items)
-            Cart.objects.filter(pk=cart_id).delete()
             return order
 
 
@@ -73,6 +142,24 @@ class OrderSerializer(serializers.ModelSerializer):
                   'placed_at', 'customer', 'orderitems']
 
 
+class AddCheckoutSerializer(serializers.ModelSerializer):
+    # the cart is only checked by the worker, queueing takes one INSERT
+    def create(self, validated_data):
+        return Checkout.objects.create(user_id=self.context['user_id'], **validated_data)
+
+    class Meta:
+        model = Checkout
+        fields = ['cart_id']
+
+
+class CheckoutSerializer(serializers.ModelSerializer):
+    order = OrderSerializer(read_only=True)
+
+    class Meta:
+        model = Checkout
+        fields = ['id', 'status', 'cart_id', 'created_at', 'order', 'errors']
+
+
 class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Review
@@ -82,10 +169,29 @@ class ReviewSerializer(serializers.ModelSerializer):
         return Review.objects.create(product_id=self.context['product_id'], **validated_data)
 
 
+class ImageVariantsField(serializers.Field):
+    # storage names -> urls, absolute when the request is known (like ImageField)
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        storage = ProductImage._meta.get_field('image').storage
+        request = self.context.get('request')
+
+        def url(name):
+            url = storage.url(name)
+            return request.build_absolute_uri(url) if request is not None else url
+        return {size: {name: url(file) for name, file in files.items()}
+                for size, files in value.items()}
+
+
 class ProductImageSerializer(serializers.ModelSerializer):
+    variants = ImageVariantsField()
+
     class Meta:
         model = ProductImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'variants']
 
     def create(self, validated_data):
         return ProductImage.objects.create(product_id=self.context['product_id'], **validated_data)
@@ -98,16 +204,19 @@ class CategorySerializer(serializers.ModelSerializer):
     product_count = serializers.IntegerField(read_only=True)
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
 
     class Meta:
         model = Product
         fields = ['id', 'title', 'slug', 'unit_price',
-                  'description', 'inventory', 'price_inc_tax', 'category', 'images']
+                  'description', 'inventory', 'price_inc_tax', 'category', 'images',
+                  'rating_avg', 'rating_count', 'rating_histogram']
 
     price_inc_tax = serializers.SerializerMethodField(
         method_name='get_price_with_tax')
+    # review count per star, {'1': n, ..., '5': n}
+    rating_histogram = serializers.SerializerMethodField()
     # string related field for relationship
     # category = serializers.StringRelatedField()
     # for object field:
@@ -119,8 +228,26 @@ class ProductSerializer(serializers.ModelSerializer):
     #     view_name='category_detail',
     # )
 
+    # tax on the price after the best promotion (see pricing.py)
     def get_price_with_tax(self, product: Product) -> Decimal:
-        return product.unit_price * Decimal(1.1)
+        return pricing.get_price(product) * TAX_MULTIPLIER
+
+    def get_rating_histogram(self, product: Product) -> dict:
+        return {str(star): getattr(product, rating_histogram_field(star)) for star in RATING_STARS}
+
+
+class ProductBulkUpdateSerializer(serializers.Serializer):
+    # mirrors the Product column rules for the two fields the ERP may change
+    id = serializers.IntegerField()
+    unit_price = serializers.DecimalField(
+        max_digits=10, decimal_places=2, min_value=0, required=False)
+    inventory = serializers.IntegerField(min_value=0, required=False)
+
+    def validate(self, data):
+        if 'unit_price' not in data and 'inventory' not in data:
+            raise serializers.ValidationError(
+                'Provide unit_price and/or inventory.')
+        return data
 
 
 class CustomerSerializer(serializers.ModelSerializer):
@@ -132,16 +259,30 @@ class CustomerSerializer(serializers.ModelSerializer):
 
 
 class CartItemSerializer(serializers.ModelSerializer):
-    total_price = serializers.SerializerMethodField(
-        method_name='get_total_price')
+    # the price after promotions and the line total, set by the cart store (see pricing.py)
+    unit_price = serializers.DecimalField(
+        max_digits=10, decimal_places=2, read_only=True)
+    total_price = serializers.DecimalField(
+        max_digits=12, decimal_places=2, read_only=True)
     product = SimpleProductSerializer()
 
     class Meta:
         model = CartItem
-        fields = ['id', 'product', 'quantity', 'total_price']
+        fields = ['id', 'product', 'quantity', 'unit_price', 'total_price']
 
-    def get_total_price(self, cartitem: CartItem) -> Decimal:
-        return cartitem.quantity * cartitem.product.unit_price
+
+class AddCartItemListSerializer(serializers.ListSerializer):
+    def save(self, **kwargs):
+        cart_id = self.context['cart_id']
+        lines = [(item['product_id'], item.get('quantity', 1)) for item in self.validated_data]
+        self.instance = get_cart_store().add_items(cart_id, lines)
+        if self.instance is None:
+            requested = {product_id for product_id, quantity in lines}
+            missing = sorted(requested - set(Product.objects.filter(
+                pk__in=requested).values_list('id', flat=True)))
+            raise serializers.ValidationError(
+                {'product_id': [f'Products {missing} were not found in our database.']})
+        return self.instance
 
 
 class AddCartItemSerializer(serializers.ModelSerializer):
@@ -150,28 +291,19 @@ class AddCartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ['product_id', 'quantity']
-
-    # ensure the product that is being added exists in the database
-    def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError(
-                'This product was not found in our database.')
-        return value
+        list_serializer_class = AddCartItemListSerializer
 
     def save(self, **kwargs):
         cart_id = self.context['cart_id']
         product_id = self.validated_data['product_id']
-        quantity = self.validated_data['quantity']
-
-        try:  # update cart item if it exists
-            cart_item = CartItem.objects.get(
-                product_id=product_id, cart_id=cart_id)
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:  # create a new cart item since one was not found
-            self.instance = CartItem.objects.create(
-                cart_id=cart_id, **self.validated_data)
+        quantity = self.validated_data.get('quantity', 1)
+
+        # the store updates the item if it exists, otherwise creates it, and
+        # checks the product exists in the same statement
+        self.instance = get_cart_store().add_item(cart_id, product_id, quantity)
+        if self.instance is None:
+            raise serializers.ValidationError(
+                {'product_id': ['This product was not found in our database.']})
         return self.instance
 
 
@@ -180,18 +312,17 @@ class UpdateCartItemSerializer(serializers.ModelSerializer):
         model = CartItem
         fields = ['quantity']
 
+    def update(self, instance, validated_data):
+        return get_cart_store().update_item(
+            self.context['cart_id'], instance.id, validated_data['quantity'])
+
 
 class CartSerializer(serializers.ModelSerializer):
     id = serializers.UUIDField(read_only=True)
-    cartitems = CartItemSerializer(many=True, read_only=True)
-    total_price = serializers.SerializerMethodField(
-        method_name='get_total_price')
-
-    def get_total_price(self, cart: Cart):
-        total_price = 0
-        for item in cart.cartitems.all():
-            total_price += item.quantity * item.product.unit_price
-        return total_price
+    # carts come from the cart store (see carts.py) with their lines in cart.items
+    cartitems = CartItemSerializer(source='items', many=True, read_only=True)
+    total_price = serializers.DecimalField(
+        max_digits=12, decimal_places=2, read_only=True)
 
     class Meta:
         model = Cart
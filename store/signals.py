@@ -1,10 +1,160 @@
-from .models import Customer
+from .models import Category, Checkout, Customer, Product, ProductImage, Promotion, Review
+from .caching import bump_catalog_version, bump_promotion_version, invalidate_top_reviews
+from .search import reindex_products, search_index
+from .tasks import create_image_variants_task, place_order_task
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
+from django.utils import timezone
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_customer_for_user(sender, **kwargs):
     if kwargs['created']:
         Customer.objects.create(user=kwargs['instance'])
+
+
+# keep the full-text document in step with the product and its category title
+@receiver(post_save, sender=Product)
+def index_product(sender, **kwargs):
+    reindex_products(Product.objects.filter(pk=kwargs['instance'].pk))
+
+
+@receiver(post_save, sender=Category)
+def index_category_products(sender, **kwargs):
+    if not kwargs['created']:
+        reindex_products(Product.objects.filter(category=kwargs['instance']))
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, **kwargs):
+    search_index.invalidate()
+
+
+# any catalog write invalidates the cached product responses (see caching.py)
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Promotion)
+@receiver(m2m_changed, sender=Product.promotions.through)
+def invalidate_catalog(sender, **kwargs):
+    bump_catalog_version()
+
+
+# cached discounts (see pricing.py) are dropped by every process on its next pricing
+@receiver([post_save, post_delete], sender=Promotion)
+@receiver(m2m_changed, sender=Product.promotions.through)
+def invalidate_promotions(sender, **kwargs):
+    bump_promotion_version()
+
+
+# promotions change price_inc_tax, so they move the Last-Modified/ETag of their products
+@receiver(post_save, sender=Promotion)
+@receiver(pre_delete, sender=Promotion)
+def touch_promoted_products(sender, **kwargs):
+    if not kwargs.get('created'):
+        Product.objects.filter(promotions=kwargs['instance']).update(
+            last_updated=timezone.now())
+
+
+@receiver(m2m_changed, sender=Product.promotions.through)
+def touch_products_of_changed_promotions(sender, **kwargs):
+    instance, action = kwargs['instance'], kwargs['action']
+    if not kwargs['reverse']:
+        # product.promotions.add/remove/clear()
+        products = Product.objects.filter(pk=instance.pk)
+    elif action == 'pre_clear':
+        # promotion.products.clear(), the links are about to go
+        products = Product.objects.filter(promotions=instance)
+    else:
+        products = Product.objects.filter(pk__in=kwargs['pk_set'] or [])
+    if action in ('post_add', 'post_remove', 'pre_clear'):
+        products.update(last_updated=timezone.now())
+
+
+# images are part of the product payload, so they move its Last-Modified/ETag
+@receiver([post_save, post_delete], sender=ProductImage)
+def touch_product(sender, **kwargs):
+    Product.objects.filter(pk=kwargs['instance'].product_id).update(
+        last_updated=timezone.now())
+
+
+# resized and WebP copies are made by a worker once the upload is committed
+@receiver(post_save, sender=ProductImage)
+def create_image_variants(sender, **kwargs):
+    if kwargs['created'] and not kwargs['raw']:
+        image_id = kwargs['instance'].id
+        transaction.on_commit(lambda: create_image_variants_task.delay(image_id))
+
+
+# asynchronous checkouts are placed by a worker once the request is committed
+@receiver(post_save, sender=Checkout)
+def place_checkout_order(sender, **kwargs):
+    if kwargs['created'] and not kwargs['raw']:
+        checkout_id = kwargs['instance'].id
+        transaction.on_commit(lambda: place_order_task.delay(checkout_id))
+
+
+def change_product_count(category_id, delta):
+    Category.objects.filter(pk=category_id).update(
+        product_count=F('product_count') + delta)
+
+
+@receiver(post_save, sender=Product)
+def count_saved_product(sender, **kwargs):
+    if kwargs['raw']:
+        return
+    product = kwargs['instance']
+    if kwargs['created']:
+        previous_category_id = None
+    else:
+        previous_category_id = getattr(
+            product, '_loaded_category_id', product.category_id)
+    if previous_category_id != product.category_id:
+        if previous_category_id is not None:
+            change_product_count(previous_category_id, -1)
+        change_product_count(product.category_id, 1)
+    product._loaded_category_id = product.category_id
+
+
+@receiver(post_delete, sender=Product)
+def count_deleted_product(sender, **kwargs):
+    product = kwargs['instance']
+    change_product_count(
+        getattr(product, '_loaded_category_id', product.category_id), -1)
+
+
+# cached top reviews of the review's product (and of its old product after a move);
+# connected before the rating receivers, which overwrite _loaded_rating
+@receiver([post_save, post_delete], sender=Review)
+def invalidate_review_summary(sender, **kwargs):
+    review = kwargs['instance']
+    product_id = getattr(review, '_loaded_rating', (review.product_id,))[0]
+    invalidate_top_reviews(review.product_id)
+    if product_id != review.product_id:
+        invalidate_top_reviews(product_id)
+
+
+# keep Product.rating_* in step with its reviews
+@receiver(post_save, sender=Review)
+def rate_saved_review(sender, **kwargs):
+    if kwargs['raw']:
+        return
+    review = kwargs['instance']
+    rating = (review.product_id, review.rating)
+    previous = None if kwargs['created'] else getattr(review, '_loaded_rating', rating)
+    if previous != rating:
+        if previous is not None:
+            Product.objects.filter(pk=previous[0]).change_rating(previous[1], -1)
+        Product.objects.filter(pk=review.product_id).change_rating(review.rating, 1)
+    review._loaded_rating = rating
+
+
+@receiver(post_delete, sender=Review)
+def rate_deleted_review(sender, **kwargs):
+    review = kwargs['instance']
+    product_id, rating = getattr(
+        review, '_loaded_rating', (review.product_id, review.rating))
+    Product.objects.filter(pk=product_id).change_rating(rating, -1)
@@ -0,0 +1,75 @@
+import logging
+from datetime import timedelta
+
+from celery import Task, shared_task
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .carts import delete_idle_carts
+from .images import create_variants
+from .models import Checkout, Product, ProductImage
+from .serializers import AddOrderSerializer
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task()
+def create_image_variants_task(image_id):
+    image = ProductImage.objects.filter(pk=image_id).first()
+    if image is None:
+        return
+    variants = create_variants(image)
+    if not variants:
+        return
+    # update() keeps the save signals from queueing the task again; the image is
+    # part of the product payload, so touching the product moves its ETag and
+    # bumps the catalog version
+    ProductImage.objects.filter(pk=image_id).update(variants=variants)
+    Product.objects.filter(pk=image.product_id).update(last_updated=timezone.now())
+
+
+# scheduled in CELERY_BEAT_SCHEDULE
+@shared_task()
+def delete_idle_carts_task():
+    result = delete_idle_carts(
+        timedelta(seconds=settings.CART_IDLE_TIMEOUT),
+        batch_size=settings.CART_CLEANUP_BATCH_SIZE,
+        max_batches=settings.CART_CLEANUP_MAX_BATCHES,
+    )
+    logger.info('Deleted %(carts)s idle carts and %(cart_items)s cart items in %(batches)s batches', result)
+    return result
+
+
+class PlaceOrderTask(Task):
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        # out of retries: fail the checkout in its own transaction instead of leaving it pending
+        checkout_id = kwargs['checkout_id'] if 'checkout_id' in kwargs else args[0]
+        Checkout.objects.filter(pk=checkout_id, status=Checkout.PENDING).update(
+            status=Checkout.FAILED, errors={'detail': ['The order could not be placed, please try again.']})
+
+
+# unexpected errors (e.g. database outages) are retried, invalid checkouts fail right away
+@shared_task(base=PlaceOrderTask, autoretry_for=(Exception,), max_retries=3,
+             retry_backoff=True, retry_backoff_max=60)
+def place_order_task(checkout_id):
+    with transaction.atomic():
+        # locked and only pending, so a redelivered task cannot place the order twice
+        checkout = Checkout.objects.select_for_update().filter(
+            pk=checkout_id, status=Checkout.PENDING).first()
+        if checkout is None:
+            return None
+        serializer = AddOrderSerializer(
+            data={'cart_id': checkout.cart_id}, context={'user_id': checkout.user_id})
+        try:
+            # the same checkout as the synchronous POST, rolled back to a savepoint on errors
+            serializer.is_valid(raise_exception=True)
+            checkout.order = serializer.save()
+            checkout.status = Checkout.COMPLETE
+        except ValidationError as error:
+            checkout.errors = error.detail
+            checkout.status = Checkout.FAILED
+        # committed with the order: clients see COMPLETE only once the order exists
+        checkout.save(update_fields=['order', 'errors', 'status'])
+    return checkout.status
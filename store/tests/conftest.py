@@ -1,4 +1,8 @@
 import pytest
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from model_bakery import baker
+from store.pricing import pricing
 from rest_framework.test import APIClient
 from django.contrib.auth.models import User
 
@@ -13,3 +17,52 @@ def authenticate(api_client):
     def do_authenticate(is_staff=False):
         return api_client.force_authenticate(user=User(is_staff=is_staff))
     return do_authenticate
+
+
+@pytest.fixture
+def customer_client(api_client):
+    api_client.force_authenticate(user=baker.make(get_user_model()))
+    return api_client
+
+
+@pytest.fixture
+def create_cart(api_client):
+    def do_create_cart():
+        return api_client.post('/store/carts/').data['id']
+    return do_create_cart
+
+
+@pytest.fixture
+def add_cart_item(api_client):
+    def do_add_cart_item(cart_id, product, quantity=1, **extra):
+        return api_client.post(f'/store/carts/{cart_id}/cartitems/',
+                               {'product_id': product.id, 'quantity': quantity}, **extra)
+    return do_add_cart_item
+
+
+@pytest.fixture(autouse=True)
+def local_memory_cache(settings):
+    # run against an in-process cache instead of the configured redis server
+    settings.CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+    cache.clear()
+    # the in-process discounts belong to the previous test's database
+    pricing.discounts.clear()
+
+
+@pytest.fixture
+def celery_eager():
+    # run .delay()ed tasks in-process instead of sending them to the broker
+    from storefront.celery import app
+    app.conf.task_always_eager = True
+    yield app
+    app.conf.task_always_eager = False
+
+
+@pytest.fixture
+def media_root(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+    return tmp_path
@@ -0,0 +1,475 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from itertools import count
+from threading import Barrier
+from random import random
+from time import sleep
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import OperationalError, connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from store.carts import DatabaseCartStore
+from store.serializers import AddOrderSerializer
+from store.tasks import delete_idle_carts_task, place_order_task
+from store.models import Cart, CartItem, Checkout, Order, Product
+from model_bakery import baker
+import pytest
+
+
+@pytest.fixture(params=['store.carts.DatabaseCartStore', 'store.carts.CacheCartStore'])
+def cart_store(request, settings):
+    settings.CART_STORE = request.param
+    return request.param
+
+
+@pytest.mark.django_db
+class TestCarts:
+    def test_cart_is_created_empty(self, api_client, cart_store):
+        response = api_client.post('/store/carts/')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['cartitems'] == []
+        assert response.data['total_price'] == 0
+
+    def test_items_are_added_and_merged_by_product(self, api_client, cart_store, create_cart, add_cart_item):
+        product = baker.make(Product, unit_price=Decimal('2.50'))
+        cart_id = create_cart()
+
+        add_cart_item(cart_id, product, 1)
+        response = add_cart_item(cart_id, product, 2)
+        cart = api_client.get(f'/store/carts/{cart_id}/')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data == {'product_id': product.id, 'quantity': 3}
+        assert [(item['product']['id'], item['quantity'], item['total_price'])
+                for item in cart.data['cartitems']] == [(product.id, 3, Decimal('7.50'))]
+        assert cart.data['total_price'] == Decimal('7.50')
+
+    def test_item_can_be_updated_and_removed(self, api_client, cart_store, create_cart, add_cart_item):
+        first, second = baker.make(Product, _quantity=2)
+        cart_id = create_cart()
+        add_cart_item(cart_id, first)
+        add_cart_item(cart_id, second)
+        items = api_client.get(f'/store/carts/{cart_id}/cartitems/').data
+
+        updated = api_client.patch(
+            f'/store/carts/{cart_id}/cartitems/{items[0]["id"]}/', {'quantity': 5})
+        deleted = api_client.delete(f'/store/carts/{cart_id}/cartitems/{items[1]["id"]}/')
+        remaining = api_client.get(f'/store/carts/{cart_id}/cartitems/').data
+
+        assert updated.data == {'quantity': 5}
+        assert deleted.status_code == status.HTTP_204_NO_CONTENT
+        assert [(item['product']['id'], item['quantity']) for item in remaining] == [(first.id, 5)]
+
+    def test_unknown_cart_or_item_returns_404(self, api_client, cart_store, create_cart):
+        cart_id = create_cart()
+
+        assert api_client.get('/store/carts/not-a-uuid/').status_code == status.HTTP_404_NOT_FOUND
+        assert api_client.get(
+            '/store/carts/00000000-0000-0000-0000-000000000000/cartitems/').status_code == status.HTTP_404_NOT_FOUND
+        assert api_client.get(f'/store/carts/{cart_id}/cartitems/1/').status_code == status.HTTP_404_NOT_FOUND
+
+    def test_cart_can_be_deleted(self, api_client, cart_store, create_cart):
+        cart_id = create_cart()
+
+        response = api_client.delete(f'/store/carts/{cart_id}/')
+
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+        assert api_client.get(f'/store/carts/{cart_id}/').status_code == status.HTTP_404_NOT_FOUND
+
+    def test_cache_carts_never_write_cart_tables(self, settings, create_cart, add_cart_item):
+        settings.CART_STORE = 'store.carts.CacheCartStore'
+        product = baker.make(Product)
+
+        add_cart_item(create_cart(), product, 2)
+
+        assert not Cart.objects.exists()
+        assert not CartItem.objects.exists()
+
+
+@pytest.mark.django_db
+class TestCartTotals:
+    def test_database_cart_is_read_with_two_queries(self, api_client, create_cart, add_cart_item,
+                                                    django_assert_num_queries):
+        cart_id = create_cart()
+        for product in baker.make(Product, _quantity=5):
+            add_cart_item(cart_id, product, 2)
+
+        api_client.get(f'/store/carts/{cart_id}/')
+
+        # the cart with its total, then its lines with their discounted prices and totals
+        with CaptureQueriesContext(connection) as queries:
+            with django_assert_num_queries(2):
+                api_client.get(f'/store/carts/{cart_id}/')
+
+        assert 'description' not in queries.captured_queries[1]['sql']
+
+    def test_totals_are_rounded_to_cents(self, api_client, cart_store, create_cart, add_cart_item):
+        cart_id = create_cart()
+        add_cart_item(cart_id, baker.make(Product, unit_price=Decimal('19.99')), 3)
+        add_cart_item(cart_id, baker.make(Product, unit_price=Decimal('0.10')), 3)
+
+        response = api_client.get(f'/store/carts/{cart_id}/')
+
+        assert sorted(item['total_price'] for item in response.data['cartitems']) == [
+            Decimal('0.30'), Decimal('59.97')]
+        assert response.data['total_price'] == Decimal('60.27')
+        assert str(response.data['total_price']) == '60.27'
+
+
+@pytest.mark.django_db
+class TestAddCartItems:
+    def test_add_is_a_single_upsert_and_a_touch(self, create_cart):
+        product = baker.make(Product)
+        cart_id = create_cart()
+        store = DatabaseCartStore()
+
+        with CaptureQueriesContext(connection) as queries:
+            first = store.add_item(cart_id, product.id, 2)
+            second = store.add_item(cart_id, product.id, 3)
+
+        upserts, touches = queries.captured_queries[::2], queries.captured_queries[1::2]
+        assert len(queries.captured_queries) == 4
+        assert all('ON CONFLICT' in query['sql'] for query in upserts)
+        assert all('last_activity' in query['sql'] for query in touches)
+        assert first.id == second.id
+        assert second.quantity == 5
+        assert CartItem.objects.get().quantity == 5
+
+    def test_fallback_without_on_conflict(self, create_cart, monkeypatch):
+        monkeypatch.setattr(connection.features, 'supports_update_conflicts_with_target', False)
+        product = baker.make(Product)
+        cart_id = create_cart()
+        store = DatabaseCartStore()
+
+        store.add_item(cart_id, product.id, 2)
+        item = store.add_item(cart_id, product.id, 3)
+
+        assert item.quantity == 5
+        assert store.add_item(cart_id, product.id + 1, 1) is None
+
+    def test_unknown_product_returns_400(self, cart_store, create_cart, add_cart_item):
+        product = baker.make(Product)
+
+        response = add_cart_item(create_cart(), Product(id=product.id + 1))
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['product_id'] == ['This product was not found in our database.']
+
+    def test_batch_adds_many_items(self, api_client, cart_store, create_cart, add_cart_item):
+        first, second = baker.make(Product, _quantity=2)
+        cart_id = create_cart()
+        add_cart_item(cart_id, first, 1)
+
+        response = api_client.post(f'/store/carts/{cart_id}/cartitems/batch/', [
+            {'product_id': first.id, 'quantity': 2},
+            {'product_id': second.id, 'quantity': 1},
+            {'product_id': first.id, 'quantity': 1},
+        ], format='json')
+        items = api_client.get(f'/store/carts/{cart_id}/cartitems/').data
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data == [{'product_id': first.id, 'quantity': 4},
+                                 {'product_id': second.id, 'quantity': 1}]
+        assert sorted((item['product']['id'], item['quantity']) for item in items) == [
+            (first.id, 4), (second.id, 1)]
+
+    def test_batch_with_unknown_product_adds_nothing(self, api_client, cart_store, create_cart):
+        product = baker.make(Product)
+        cart_id = create_cart()
+
+        response = api_client.post(f'/store/carts/{cart_id}/cartitems/batch/', [
+            {'product_id': product.id, 'quantity': 2},
+            {'product_id': product.id + 1, 'quantity': 1},
+        ], format='json')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert str(product.id + 1) in response.data['product_id'][0]
+        assert api_client.get(f'/store/carts/{cart_id}/cartitems/').data == []
+
+
+@pytest.mark.django_db
+class TestCheckout:
+    def test_checkout_turns_the_cart_into_an_order(self, customer_client, cart_store, create_cart,
+                                                   add_cart_item, django_capture_on_commit_callbacks):
+        first, second = baker.make(Product, unit_price=Decimal('3.00'), inventory=5, _quantity=2)
+        cart_id = create_cart()
+        add_cart_item(cart_id, first, 2)
+        add_cart_item(cart_id, second, 1)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = customer_client.post('/store/orders/', {'cart_id': cart_id})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        order = Order.objects.get(pk=response.data['id'])
+        assert sorted(order.orderitems.values_list('product_id', 'quantity', 'unit_price')) == [
+            (first.id, 2, Decimal('3.00')), (second.id, 1, Decimal('3.00'))]
+        assert customer_client.get(f'/store/carts/{cart_id}/').status_code == status.HTTP_404_NOT_FOUND
+        assert dict(Product.objects.values_list('id', 'inventory')) == {first.id: 3, second.id: 4}
+
+    def test_out_of_stock_line_fails_the_whole_checkout(self, customer_client, cart_store,
+                                                        create_cart, add_cart_item):
+        in_stock = baker.make(Product, inventory=5)
+        short = baker.make(Product, title='Milk', inventory=1)
+        cart_id = create_cart()
+        add_cart_item(cart_id, in_stock, 2)
+        add_cart_item(cart_id, short, 2)
+
+        response = customer_client.post('/store/orders/', {'cart_id': cart_id})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['products'] == {short.id: ['Only 1 of "Milk" left in stock.']}
+        assert dict(Product.objects.values_list('id', 'inventory')) == {in_stock.id: 5, short.id: 1}
+        assert not Order.objects.exists()
+        assert customer_client.get(f'/store/carts/{cart_id}/').status_code == status.HTTP_200_OK
+
+    def test_empty_or_unknown_cart_cannot_be_checked_out(self, customer_client, cart_store, create_cart):
+        empty = customer_client.post('/store/orders/', {'cart_id': create_cart()})
+        unknown = customer_client.post(
+            '/store/orders/', {'cart_id': '00000000-0000-0000-0000-000000000000'})
+
+        assert empty.data['cart_id'] == ['This cart is empty.']
+        assert unknown.data['cart_id'] == ['This cart does not exist.']
+
+    def test_a_cart_is_checked_out_once(self, cart_store, create_cart, add_cart_item):
+        cart_id = create_cart()
+        add_cart_item(cart_id, baker.make(Product, inventory=5), 2)
+        serializers = [AddOrderSerializer(data={'cart_id': cart_id}, context={'user_id': user.id})
+                       for user in baker.make(get_user_model(), _quantity=2)]
+        # both read the cart before either places its order
+        for serializer in serializers:
+            serializer.is_valid(raise_exception=True)
+
+        serializers[0].save()
+        with pytest.raises(ValidationError) as error:
+            serializers[1].save()
+
+        assert error.value.detail == {'cart_id': ['This cart does not exist.']}
+        assert Order.objects.count() == 1
+        assert Product.objects.get().inventory == 3
+
+    def test_cart_survives_an_out_of_stock_checkout(self, customer_client, cart_store, create_cart,
+                                                     add_cart_item):
+        cart_id = create_cart()
+        add_cart_item(cart_id, baker.make(Product, inventory=1), 2)
+
+        customer_client.post('/store/orders/', {'cart_id': cart_id})
+
+        assert customer_client.get(f'/store/carts/{cart_id}/').data['cartitems'][0]['quantity'] == 2
+
+    def test_cache_cart_survives_a_failed_checkout(self, settings, customer_client, create_cart,
+                                                   add_cart_item, monkeypatch):
+        settings.CART_STORE = 'store.carts.CacheCartStore'
+        cart_id = create_cart()
+        add_cart_item(cart_id, baker.make(Product, inventory=1))
+        monkeypatch.setattr('store.serializers.OrderItem.objects.bulk_create',
+                            lambda items: (_ for _ in ()).throw(RuntimeError('database down')))
+
+        with pytest.raises(RuntimeError):
+            customer_client.post('/store/orders/', {'cart_id': cart_id})
+
+        assert cache.get(f'store:cart:{cart_id}') is not None
+
+
+@pytest.fixture
+def checkout_async(customer_client):
+    def do_checkout_async(cart_id):
+        return customer_client.post('/store/orders/', {'cart_id': cart_id},
+                                    HTTP_PREFER='respond-async')
+    return do_checkout_async
+
+
+@pytest.mark.django_db
+class TestAsyncCheckout:
+    def test_checkout_is_queued_and_then_placed(self, customer_client, checkout_async, create_cart,
+                                                add_cart_item, celery_eager,
+                                                django_capture_on_commit_callbacks):
+        product = baker.make(Product, unit_price=Decimal('3.00'), inventory=5)
+        cart_id = create_cart()
+        add_cart_item(cart_id, product, 2)
+
+        with django_capture_on_commit_callbacks() as callbacks:
+            response = checkout_async(cart_id)
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response['Preference-Applied'] == 'respond-async'
+        assert response.data['status'] == Checkout.PENDING
+        assert response.data['order'] is None
+        assert not Order.objects.exists()
+
+        for callback in callbacks:
+            callback()
+        checkout = customer_client.get(response['Location'])
+
+        assert checkout.data['status'] == Checkout.COMPLETE
+        assert checkout.data['order']['id'] == Order.objects.get().id
+        assert [(item['product']['id'], item['quantity']) for item in checkout.data['order']['orderitems']] == [
+            (product.id, 2)]
+        assert customer_client.get(f'/store/carts/{cart_id}/').status_code == status.HTTP_404_NOT_FOUND
+
+    def test_failed_checkout_reports_the_errors(self, customer_client, checkout_async, create_cart,
+                                                celery_eager, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            response = checkout_async(create_cart())
+
+        checkout = customer_client.get(response['Location'])
+
+        assert checkout.data['status'] == Checkout.FAILED
+        assert checkout.data['errors'] == {'cart_id': ['This cart is empty.']}
+        assert checkout.data['order'] is None
+
+    def test_redelivered_task_places_the_order_once(self, customer_client, checkout_async, create_cart,
+                                                    add_cart_item):
+        cart_id = create_cart()
+        add_cart_item(cart_id, baker.make(Product, inventory=5))
+        checkout_id = checkout_async(cart_id).data['id']
+
+        assert place_order_task(checkout_id) == Checkout.COMPLETE
+        assert place_order_task(checkout_id) is None
+        assert Order.objects.count() == 1
+
+    def test_unexpected_errors_are_retried_and_then_fail_the_checkout(
+            self, customer_client, checkout_async, create_cart, add_cart_item, celery_eager,
+            monkeypatch, caplog):
+        # celery's eager failure tracebacks cannot be formatted by the captured log handler
+        caplog.set_level(logging.CRITICAL, logger='celery.app.trace')
+        cart_id = create_cart()
+        add_cart_item(cart_id, baker.make(Product, inventory=5))
+        checkout_id = checkout_async(cart_id).data['id']
+        attempts = []
+
+        def save(serializer):
+            attempts.append(serializer)
+            raise OperationalError('database is unavailable')
+        monkeypatch.setattr(AddOrderSerializer, 'save', save)
+
+        place_order_task.delay(checkout_id)
+        checkout = Checkout.objects.get(pk=checkout_id)
+
+        assert len(attempts) == 1 + place_order_task.max_retries
+        assert checkout.status == Checkout.FAILED
+        assert checkout.errors == {'detail': ['The order could not be placed, please try again.']}
+        assert not Order.objects.exists()
+
+    def test_checkouts_of_other_users_are_not_found(self, api_client, checkout_async, create_cart):
+        response = checkout_async(create_cart())
+        api_client.force_authenticate(user=baker.make(get_user_model()))
+
+        assert api_client.get(response['Location']).status_code == status.HTTP_404_NOT_FOUND
+
+    def test_without_preference_checkout_stays_synchronous(self, customer_client, create_cart,
+                                                           add_cart_item):
+        cart_id = create_cart()
+        add_cart_item(cart_id, baker.make(Product, inventory=5))
+
+        response = customer_client.post('/store/orders/', {'cart_id': cart_id}, HTTP_PREFER='return=minimal')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert not Checkout.objects.exists()
+
+
+@pytest.mark.django_db(transaction=True)
+class TestConcurrentCheckout:
+    def test_parallel_checkouts_never_oversell(self, create_cart, add_cart_item):
+        checkouts, inventory = 20, 7
+        product = baker.make(Product, inventory=inventory)
+        other = baker.make(Product, inventory=checkouts)
+        carts = []
+        for index in range(checkouts):
+            cart_id = create_cart()
+            # lines in both orders, reservations still lock products in the same order
+            for line in ([product, other] if index % 2 else [other, product]):
+                add_cart_item(cart_id, line)
+            carts.append(cart_id)
+        users = baker.make(get_user_model(), _quantity=checkouts)
+        start = Barrier(checkouts)
+
+        def checkout(user, cart_id):
+            serializer = AddOrderSerializer(data={'cart_id': cart_id}, context={'user_id': user.id})
+            try:
+                start.wait()
+                for attempt in count():
+                    try:
+                        serializer.is_valid(raise_exception=True)
+                        serializer.save()
+                        return status.HTTP_201_CREATED
+                    except ValidationError:
+                        return status.HTTP_400_BAD_REQUEST
+                    except OperationalError as error:
+                        # sqlite (shared cache) fails instead of waiting for a table
+                        # lock, the checkout was rolled back: back off and retry.
+                        # Anything else (e.g. a deadlock) is a real failure
+                        if connection.vendor != 'sqlite' or 'database table is locked' not in str(error):
+                            raise
+                        serializer = AddOrderSerializer(
+                            data={'cart_id': cart_id}, context={'user_id': user.id})
+                        sleep(random() * 0.002 * 2 ** min(attempt, 8))
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(checkouts) as executor:
+            statuses = list(executor.map(checkout, users, carts))
+
+        assert statuses.count(status.HTTP_201_CREATED) == inventory
+        assert statuses.count(status.HTTP_400_BAD_REQUEST) == checkouts - inventory
+        assert dict(Product.objects.values_list('id', 'inventory')) == {
+            product.id: 0, other.id: checkouts - inventory}
+        assert Order.objects.count() == inventory
+
+
+def age_carts(carts, days):
+    Cart.objects.filter(pk__in=[cart.pk for cart in carts]).update(
+        created_at=timezone.now() - timedelta(days=days), last_activity=timezone.now() - timedelta(days=days))
+
+
+@pytest.mark.django_db
+class TestIdleCartCleanup:
+    def test_idle_carts_and_their_items_are_deleted(self, settings):
+        settings.CART_IDLE_TIMEOUT = 60 * 60 * 24
+        idle_carts = baker.make(Cart, _quantity=3)
+        active_cart = baker.make(Cart)
+        baker.make(CartItem, cart=idle_carts[0], _quantity=2)
+        baker.make(CartItem, cart=active_cart)
+        age_carts(idle_carts, days=2)
+
+        result = delete_idle_carts_task()
+
+        assert result == {'carts': 3, 'cart_items': 2, 'batches': 1}
+        assert list(Cart.objects.values_list('id', flat=True)) == [active_cart.id]
+        assert CartItem.objects.filter(cart=active_cart).count() == 1
+
+    def test_old_carts_still_in_use_are_kept(self, settings, api_client, create_cart, add_cart_item):
+        settings.CART_IDLE_TIMEOUT = 60 * 60 * 24
+        carts = [Cart.objects.get(pk=create_cart()) for _ in range(3)]
+        added, updated, removed = carts
+        for cart in [updated, removed]:
+            add_cart_item(cart.id, baker.make(Product))
+        age_carts(carts, days=2)
+
+        add_cart_item(added.id, baker.make(Product))
+        api_client.patch(f'/store/carts/{updated.id}/cartitems/{updated.cartitems.get().id}/',
+                         {'quantity': 3})
+        api_client.delete(f'/store/carts/{removed.id}/cartitems/{removed.cartitems.get().id}/')
+        result = delete_idle_carts_task()
+
+        assert result == {'carts': 0, 'cart_items': 0, 'batches': 0}
+        assert Cart.objects.count() == 3
+
+    def test_deletes_oldest_first_in_bounded_batches(self, settings):
+        settings.CART_IDLE_TIMEOUT = 60 * 60 * 24
+        settings.CART_CLEANUP_BATCH_SIZE = 2
+        settings.CART_CLEANUP_MAX_BATCHES = 2
+        carts = baker.make(Cart, _quantity=5)
+        for days, cart in enumerate(carts, start=2):
+            age_carts([cart], days=days)
+
+        result = delete_idle_carts_task()
+
+        assert result == {'carts': 4, 'cart_items': 0, 'batches': 2}
+        # the newest idle cart is left for the next run
+        assert list(Cart.objects.values_list('id', flat=True)) == [carts[0].id]
@@ -1,3 +1,5 @@
+from io import StringIO
+from django.core.management import call_command
 from rest_framework import status
 from store.models import Category, Product
 from model_bakery import baker
@@ -163,3 +165,82 @@ class TestDeleteCategory:
         response = delete_category()
 
         assert response.status_code == status.HTTP_204_NO_CONTENT
+
+
+@pytest.mark.django_db
+class TestConditionalGetCategories:
+    def test_unchanged_categories_return_304(self, get_categories, api_client):
+        baker.make(Category, _quantity=2)
+        etag = get_categories()['ETag']
+
+        response = api_client.get(
+            '/store/categories/', HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_new_product_changes_category_etag(self, get_categories, api_client):
+        category = baker.make(Category)
+        etag = get_categories(id=category.id)['ETag']
+
+        baker.make(Product, category=category)
+        response = api_client.get(
+            f'/store/categories/{category.id}/', HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['product_count'] == 1
+
+
+@pytest.mark.django_db
+class TestCategoryProductCount:
+    def test_created_and_deleted_products_are_counted(self):
+        category = baker.make(Category)
+        products = baker.make(Product, category=category, _quantity=3)
+
+        products[0].delete()
+        category.refresh_from_db()
+
+        assert category.product_count == 2
+
+    def test_moved_product_changes_both_counts(self):
+        source, target = baker.make(Category, _quantity=2)
+        product = baker.make(Product, category=source)
+
+        product = Product.objects.get(pk=product.pk)
+        product.category = target
+        product.save()
+        source.refresh_from_db()
+        target.refresh_from_db()
+
+        assert (source.product_count, target.product_count) == (0, 1)
+
+    def test_queryset_update_and_bulk_create_are_counted(self):
+        source, target = baker.make(Category, _quantity=2)
+        Product.objects.bulk_create(
+            baker.prepare(Product, category=source, _quantity=4))
+
+        Product.objects.filter(
+            pk__in=Product.objects.values('pk')[:3]).update(category=target)
+        source.refresh_from_db()
+        target.refresh_from_db()
+
+        assert (source.product_count, target.product_count) == (1, 3)
+
+    def test_rebuild_command_repairs_drift(self):
+        category = baker.make(Category)
+        baker.make(Product, category=category, _quantity=2)
+        Category.objects.update(product_count=42)
+
+        call_command('rebuild_product_counts', stdout=StringIO())
+        category.refresh_from_db()
+
+        assert category.product_count == 2
+
+    def test_listing_reads_the_stored_count(self, get_categories, django_assert_num_queries):
+        category = baker.make(Category)
+        baker.make(Product, category=category, _quantity=2)
+
+        with django_assert_num_queries(1) as context:
+            response = get_categories()
+
+        assert response.data[0]['product_count'] == 2
+        assert 'store_product' not in context.captured_queries[0]['sql']
@@ -0,0 +1,110 @@
+from types import SimpleNamespace
+from django.contrib.auth import get_user_model
+from rest_framework import status
+from store.caching import cache_lock
+from store.idempotency import idempotency_cache_key
+from store.models import CartItem, Order, Product
+from model_bakery import baker
+import pytest
+
+
+@pytest.fixture
+def cart_id(create_cart):
+    return create_cart()
+
+
+@pytest.mark.django_db
+class TestIdempotentCheckout:
+    def test_retry_replays_the_order(self, customer_client, cart_id, add_cart_item):
+        add_cart_item(cart_id, baker.make(Product, inventory=5))
+
+        first = customer_client.post('/store/orders/', {'cart_id': cart_id}, HTTP_IDEMPOTENCY_KEY='order-1')
+        retry = customer_client.post('/store/orders/', {'cart_id': cart_id}, HTTP_IDEMPOTENCY_KEY='order-1')
+
+        assert first.status_code == retry.status_code == status.HTTP_201_CREATED
+        assert retry.data == first.data
+        assert retry['Idempotent-Replayed'] == 'true'
+        assert Order.objects.count() == 1
+
+    def test_without_key_a_retry_runs_again(self, customer_client, cart_id, add_cart_item):
+        add_cart_item(cart_id, baker.make(Product, inventory=5))
+
+        customer_client.post('/store/orders/', {'cart_id': cart_id})
+        retry = customer_client.post('/store/orders/', {'cart_id': cart_id})
+
+        assert retry.status_code == status.HTTP_400_BAD_REQUEST
+        assert retry.data['cart_id'] == ['This cart does not exist.']
+
+    def test_key_reused_with_another_cart_returns_422(self, api_client, customer_client, cart_id,
+                                                      add_cart_item):
+        add_cart_item(cart_id, baker.make(Product, inventory=5))
+        other_cart_id = api_client.post('/store/carts/').data['id']
+
+        customer_client.post('/store/orders/', {'cart_id': cart_id}, HTTP_IDEMPOTENCY_KEY='order-1')
+        response = customer_client.post(
+            '/store/orders/', {'cart_id': other_cart_id}, HTTP_IDEMPOTENCY_KEY='order-1')
+
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_errors_are_not_replayed(self, customer_client, cart_id, add_cart_item):
+        empty = customer_client.post('/store/orders/', {'cart_id': cart_id}, HTTP_IDEMPOTENCY_KEY='order-1')
+        add_cart_item(cart_id, baker.make(Product, inventory=5))
+        retry = customer_client.post('/store/orders/', {'cart_id': cart_id}, HTTP_IDEMPOTENCY_KEY='order-1')
+
+        assert empty.status_code == status.HTTP_400_BAD_REQUEST
+        assert retry.status_code == status.HTTP_201_CREATED
+
+    def test_duplicate_of_a_request_in_flight_returns_409(self, settings, api_client, cart_id,
+                                                          add_cart_item):
+        settings.IDEMPOTENCY_LOCK_WAIT = 0
+        add_cart_item(cart_id, baker.make(Product, inventory=5))
+        user = baker.make(get_user_model())
+        api_client.force_authenticate(user=user)
+        in_flight = SimpleNamespace(user=user, method='POST', path='/store/orders/')
+
+        with cache_lock(idempotency_cache_key(in_flight, 'order-1')):
+            response = api_client.post(
+                '/store/orders/', {'cart_id': cart_id}, HTTP_IDEMPOTENCY_KEY='order-1')
+
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert not Order.objects.exists()
+
+    def test_keys_are_per_user(self, api_client, cart_id, add_cart_item):
+        add_cart_item(cart_id, baker.make(Product, inventory=5))
+        api_client.force_authenticate(user=baker.make(get_user_model()))
+        api_client.post('/store/orders/', {'cart_id': cart_id}, HTTP_IDEMPOTENCY_KEY='order-1')
+        api_client.force_authenticate(user=baker.make(get_user_model()))
+
+        response = api_client.post('/store/orders/', {'cart_id': cart_id}, HTTP_IDEMPOTENCY_KEY='order-1')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+class TestIdempotentCartItems:
+    def test_retried_add_does_not_add_again(self, cart_id, add_cart_item):
+        product = baker.make(Product)
+
+        first = add_cart_item(cart_id, product, 2, HTTP_IDEMPOTENCY_KEY='add-1')
+        retry = add_cart_item(cart_id, product, 2, HTTP_IDEMPOTENCY_KEY='add-1')
+        add_cart_item(cart_id, product, 2, HTTP_IDEMPOTENCY_KEY='add-2')
+
+        assert first.status_code == retry.status_code == status.HTTP_201_CREATED
+        assert retry.data == first.data
+        assert CartItem.objects.get(cart_id=cart_id).quantity == 4
+
+    def test_retried_batch_does_not_add_again(self, api_client, cart_id):
+        product = baker.make(Product)
+        lines = [{'product_id': product.id, 'quantity': 3}]
+
+        for _ in range(2):
+            response = api_client.post(f'/store/carts/{cart_id}/cartitems/batch/', lines,
+                                       format='json', HTTP_IDEMPOTENCY_KEY='batch-1')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert CartItem.objects.get(cart_id=cart_id).quantity == 3
+
+    def test_overlong_key_returns_400(self, cart_id, add_cart_item):
+        response = add_cart_item(cart_id, baker.make(Product), HTTP_IDEMPOTENCY_KEY='k' * 256)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
@@ -0,0 +1,112 @@
+import json
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from store.models import Order, OrderItem
+from model_bakery import baker
+import pytest
+
+
+@pytest.fixture
+def orders():
+    # ten orders, one day apart and oldest first, alternating between two customers
+    customers = [user.customer for user in baker.make(get_user_model(), _quantity=2)]
+    now = timezone.now()
+    orders = []
+    for index in range(10):
+        order = baker.make(Order, customer=customers[index % 2],
+                           payment_status=Order.COMPLETE if index % 3 == 0 else Order.PENDING)
+        baker.make(OrderItem, order=order, _quantity=2)
+        Order.objects.filter(pk=order.pk).update(placed_at=now - timedelta(days=10 - index))
+        orders.append(Order.objects.get(pk=order.pk))
+    return orders
+
+
+def ids(response):
+    return [order['id'] for order in response.data['results']]
+
+
+@pytest.mark.django_db
+class TestStaffOrderList:
+    def test_pages_are_cursor_paginated_newest_first(self, api_client, authenticate, orders, monkeypatch):
+        monkeypatch.setattr('store.paginations.OrderCursorPagination.page_size', 4)
+        authenticate(is_staff=True)
+
+        first = api_client.get('/store/orders/')
+        second = api_client.get(first.data['next'])
+
+        assert first.status_code == status.HTTP_200_OK
+        assert ids(first) + ids(second) == [order.id for order in reversed(orders)][:8]
+        assert 'count' not in first.data
+
+    def test_page_takes_two_queries(self, api_client, authenticate, orders):
+        authenticate(is_staff=True)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = api_client.get('/store/orders/')
+
+        assert len(response.data['results'][0]['orderitems']) == 2
+        assert len(queries) == 2
+
+    def test_filters(self, api_client, authenticate, orders):
+        authenticate(is_staff=True)
+        customer = orders[0].customer
+
+        complete = api_client.get(f'/store/orders/?payment_status={Order.COMPLETE}')
+        by_customer = api_client.get(f'/store/orders/?customer_id={customer.id}')
+        in_range = api_client.get('/store/orders/', {
+            'placed_at__gte': orders[2].placed_at.isoformat(),
+            'placed_at__lt': orders[5].placed_at.isoformat()})
+
+        assert set(ids(complete)) == {order.id for order in orders if order.payment_status == Order.COMPLETE}
+        assert set(ids(by_customer)) == {order.id for order in orders if order.customer_id == customer.id}
+        assert ids(in_range) == [orders[4].id, orders[3].id, orders[2].id]
+
+
+@pytest.mark.django_db
+class TestCustomerOrderList:
+    def test_customer_sees_only_own_orders(self, api_client, orders):
+        user = baker.make(get_user_model())
+        own = baker.make(Order, customer=user.customer)
+        api_client.force_authenticate(user=user)
+
+        response = api_client.get('/store/orders/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [order['id'] for order in response.data] == [own.id]
+
+
+@pytest.mark.django_db
+class TestOrderExport:
+    def test_staff_export_streams_filtered_orders_as_ndjson(self, api_client, authenticate, orders):
+        authenticate(is_staff=True)
+
+        response = api_client.get(f'/store/orders/export/?payment_status={Order.PENDING}')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+        assert response['Content-Type'] == 'application/x-ndjson'
+        assert [line['id'] for line in lines] == [
+            order.id for order in orders if order.payment_status == Order.PENDING]
+        assert all(len(line['orderitems']) == 2 for line in lines)
+
+    def test_export_is_read_in_chunks(self, api_client, authenticate, orders, monkeypatch):
+        monkeypatch.setattr('store.views.OrderViewSet.export_chunk_size', 4)
+        authenticate(is_staff=True)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = api_client.get('/store/orders/export/')
+            lines = b''.join(response.streaming_content).splitlines()
+
+        assert len(lines) == len(orders)
+        # one (server-side cursor) orders query, and an items query per chunk of 4
+        assert len(queries) == 1 + 3
+
+    def test_customers_cannot_export(self, api_client, authenticate):
+        authenticate()
+
+        response = api_client.get('/store/orders/export/')
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
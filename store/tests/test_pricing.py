@@ -0,0 +1,148 @@
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from rest_framework import status
+from store.models import OrderItem, Product, Promotion
+from store.pricing import discounted_price, pricing
+from model_bakery import baker
+import pytest
+
+
+@pytest.fixture
+def promoted_product():
+    def do_promoted_product(unit_price, *discounts):
+        product = baker.make(Product, unit_price=Decimal(unit_price))
+        for discount in discounts:
+            product.promotions.add(baker.make(Promotion, discount=discount))
+        return product
+    return do_promoted_product
+
+
+class TestDiscountedPrice:
+    def test_discount_is_a_percentage_rounded_to_cents(self):
+        assert discounted_price(Decimal('19.99'), 15) == Decimal('16.99')
+        assert discounted_price(Decimal('10.00'), Decimal('12.5')) == Decimal('8.75')
+
+    def test_discount_is_capped_at_the_price(self):
+        assert discounted_price(Decimal('10.00'), 150) == Decimal('0.00')
+
+
+@pytest.mark.django_db
+class TestPromotionPricing:
+    def test_best_promotion_applies(self, promoted_product):
+        product = promoted_product('20.00', 10, 25)
+        plain = baker.make(Product, unit_price=Decimal('20.00'))
+
+        assert pricing.get_prices([product, plain]) == {
+            product.id: Decimal('15.00'), plain.id: Decimal('20.00')}
+
+    def test_discounts_are_cached_in_process(self, promoted_product, django_assert_num_queries):
+        products = [promoted_product('10.00', 10) for _ in range(3)]
+        pricing.get_prices(products)
+
+        with django_assert_num_queries(0):
+            prices = pricing.get_prices(products)
+
+        assert set(prices.values()) == {Decimal('9.00')}
+
+    def test_eviction_keeps_the_discounts_of_the_current_call(self, promoted_product, monkeypatch):
+        monkeypatch.setattr(pricing, 'max_entries', 2)
+        cached = [promoted_product('10.00', 20) for _ in range(2)]
+        new = promoted_product('10.00', 50)
+        pricing.get_prices(cached)
+
+        # the cache is full: loading the new product clears it
+        prices = pricing.get_prices([*cached, new])
+
+        assert [prices[product.id] for product in [*cached, new]] == [
+            Decimal('8.00'), Decimal('8.00'), Decimal('5.00')]
+        assert list(pricing.discounts) == [new.id]
+
+    def test_promotion_changes_invalidate_the_cache(self, promoted_product):
+        product = promoted_product('10.00', 10)
+        pricing.get_price(product)
+
+        promotion = product.promotions.get()
+        promotion.discount = 50
+        promotion.save()
+        changed = pricing.get_price(product)
+        product.promotions.clear()
+        removed = pricing.get_price(product)
+
+        assert (changed, removed) == (Decimal('5.00'), Decimal('10.00'))
+
+    def test_product_price_inc_tax_uses_the_discount(self, api_client, promoted_product):
+        product = promoted_product('10.00', 50)
+
+        detail = api_client.get(f'/store/products/{product.id}/')
+        listed = api_client.get('/store/products/')
+
+        assert detail.data['price_inc_tax'] == Decimal('5.00') * Decimal(1.1)
+        assert listed.data['results'][0]['price_inc_tax'] == detail.data['price_inc_tax']
+
+    @pytest.mark.parametrize('change', ['add', 'discount', 'remove', 'clear', 'delete'])
+    def test_promotion_changes_move_the_product_etag(self, api_client, promoted_product, change):
+        product = promoted_product('10.00', 10)
+        promotion = product.promotions.get()
+        detail_etag = api_client.get(f'/store/products/{product.id}/')['ETag']
+        list_etag = api_client.get('/store/products/')['ETag']
+
+        if change == 'add':
+            product.promotions.add(baker.make(Promotion, discount=50))
+        elif change == 'discount':
+            promotion.discount = 50
+            promotion.save()
+        elif change == 'remove':
+            promotion.product_set.remove(product)
+        elif change == 'clear':
+            promotion.product_set.clear()
+        else:
+            promotion.delete()
+        detail = api_client.get(f'/store/products/{product.id}/', HTTP_IF_NONE_MATCH=detail_etag)
+        listing = api_client.get('/store/products/', HTTP_IF_NONE_MATCH=list_etag)
+
+        assert detail.status_code == listing.status_code == status.HTTP_200_OK
+        assert detail.data['price_inc_tax'] != Decimal('9.00') * Decimal(1.1)
+
+    def test_database_cart_is_priced_in_sql(self, api_client, promoted_product,
+                                            django_assert_num_queries):
+        cart_id = api_client.post('/store/carts/').data['id']
+        for _ in range(3):
+            product = promoted_product('10.00', 20)
+            api_client.post(f'/store/carts/{cart_id}/cartitems/',
+                            {'product_id': product.id, 'quantity': 2})
+        pricing.discounts.clear()
+
+        # the cart with its total, then its lines with their prices and totals
+        with django_assert_num_queries(2):
+            response = api_client.get(f'/store/carts/{cart_id}/')
+
+        assert {item['unit_price'] for item in response.data['cartitems']} == {Decimal('8.00')}
+        assert response.data['total_price'] == Decimal('48.00')
+
+    @pytest.mark.parametrize('cart_store', ['store.carts.DatabaseCartStore', 'store.carts.CacheCartStore'])
+    def test_cart_stores_price_like_the_engine(self, settings, api_client, promoted_product, cart_store):
+        settings.CART_STORE = cart_store
+        products = [promoted_product('19.99', 12.5), promoted_product('0.10', 10, 15),
+                    promoted_product('5.00', 150), promoted_product('7.35')]
+        cart_id = api_client.post('/store/carts/').data['id']
+        for product in products:
+            api_client.post(f'/store/carts/{cart_id}/cartitems/',
+                            {'product_id': product.id, 'quantity': 3})
+
+        response = api_client.get(f'/store/carts/{cart_id}/')
+
+        prices = pricing.get_prices(Product.objects.filter(pk__in=[product.id for product in products]))
+        assert {item['product']['id']: item['unit_price'] for item in response.data['cartitems']} == prices
+        assert response.data['total_price'] == sum(price * 3 for price in prices.values())
+
+    def test_checkout_snapshots_the_discounted_price(self, api_client, promoted_product):
+        api_client.force_authenticate(user=baker.make(get_user_model()))
+        product = promoted_product('10.00', 30)
+        cart_id = api_client.post('/store/carts/').data['id']
+        api_client.post(f'/store/carts/{cart_id}/cartitems/', {'product_id': product.id, 'quantity': 1})
+
+        response = api_client.post('/store/orders/', {'cart_id': cart_id})
+        product.promotions.clear()
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert OrderItem.objects.get(order_id=response.data['id']).unit_price == Decimal('7.00')
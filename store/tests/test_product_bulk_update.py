@@ -0,0 +1,107 @@
+from decimal import Decimal
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from store.models import Product
+from model_bakery import baker
+import pytest
+
+
+@pytest.fixture
+def bulk_update(api_client):
+    def do_bulk_update(items):
+        return api_client.post('/store/products/bulk-update/', items, format='json')
+    return do_bulk_update
+
+
+@pytest.mark.django_db
+class TestBulkUpdateProducts:
+    def test_if_user_is_not_admin_returns_403(self, authenticate, bulk_update):
+        authenticate()
+
+        response = bulk_update([])
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_if_data_is_not_a_list_returns_400(self, authenticate, bulk_update):
+        authenticate(is_staff=True)
+
+        response = bulk_update({'id': 1, 'inventory': 3})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_rows_are_updated_and_reported_in_order(self, authenticate, bulk_update):
+        authenticate(is_staff=True)
+        first, second, third = baker.make(
+            Product, unit_price=Decimal('1.00'), inventory=5, _quantity=3)
+
+        response = bulk_update([
+            {'id': first.id, 'unit_price': '2.50'},
+            {'id': second.id, 'unit_price': '1.00', 'inventory': 5},
+            {'id': third.id, 'inventory': -1},
+            {'id': third.id + 100, 'inventory': 1},
+            {'id': third.id},
+        ])
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [(row['id'], row['status']) for row in response.data] == [
+            (first.id, 'updated'),
+            (second.id, 'unchanged'),
+            (third.id, 'invalid'),
+            (third.id + 100, 'not_found'),
+            (third.id, 'invalid'),
+        ]
+        assert 'inventory' in response.data[2]['errors']
+        first.refresh_from_db()
+        assert first.unit_price == Decimal('2.50')
+        assert first.inventory == 5
+
+    def test_unchanged_rows_are_not_written(self, authenticate, bulk_update):
+        authenticate(is_staff=True)
+        product = baker.make(Product, unit_price=Decimal('1.00'), inventory=5)
+        last_updated = product.last_updated
+
+        bulk_update([{'id': product.id, 'unit_price': '1.00'}])
+
+        product.refresh_from_db()
+        assert product.last_updated == last_updated
+
+    def test_batch_is_written_with_one_update(self, authenticate, bulk_update):
+        authenticate(is_staff=True)
+        products = baker.make(Product, unit_price=Decimal('1.00'), _quantity=20)
+
+        with CaptureQueriesContext(connection) as queries:
+            bulk_update([{'id': product.id, 'inventory': index}
+                         for index, product in enumerate(products)])
+
+        updates = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE "store_product"')]
+        assert len(updates) == 1
+        assert sorted(Product.objects.values_list('inventory', flat=True)) == list(range(20))
+
+
+@pytest.mark.django_db
+class TestAdminListEditable:
+    def test_changelist_saves_go_through_bulk_update(self, admin_client):
+        products = baker.make(Product, unit_price=Decimal('1.00'), inventory=5, _quantity=2)
+        data = {
+            'form-TOTAL_FORMS': 2,
+            'form-INITIAL_FORMS': 2,
+            '_save': 'Save',
+        }
+        for index, product in enumerate(products):
+            data.update({
+                f'form-{index}-id': product.id,
+                f'form-{index}-unit_price': '3.00' if index == 0 else '1.00',
+                f'form-{index}-inventory': 5,
+            })
+
+        with CaptureQueriesContext(connection) as queries:
+            response = admin_client.post('/admin/store/product/', data)
+
+        assert response.status_code == 302
+        updates = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE "store_product"')]
+        assert len(updates) == 1
+        assert 'CASE' in updates[0]
+        assert Product.objects.get(pk=products[0].id).unit_price == Decimal('3.00')
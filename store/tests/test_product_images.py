@@ -0,0 +1,122 @@
+from io import BytesIO
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+from django.contrib import admin
+from rest_framework import status
+from store.admin import ProductImageInline
+from store.models import Product, ProductImage
+from store.tasks import create_image_variants_task
+from store.uploads import ProductImageUploadHandler, sniff_image_type
+from store.validators import MAX_IMAGE_SIZE_KB
+from model_bakery import baker
+import pytest
+
+
+def make_upload(size=(2000, 1000), image_format='JPEG', name='photo.jpg'):
+    buffer = BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, image_format)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+@pytest.mark.django_db
+class TestProductImageVariants:
+    def test_upload_queues_variants_after_commit(self, api_client, celery_eager, media_root,
+                                                 django_capture_on_commit_callbacks):
+        product = baker.make(Product)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = api_client.post(f'/store/products/{product.id}/images/',
+                                       {'image': make_upload()}, format='multipart')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['variants'] == {}
+        image = ProductImage.objects.get(pk=response.data['id'])
+        assert set(image.variants) == {'thumbnail', 'small', 'large'}
+        with Image.open(media_root / image.variants['small']['webp']) as small:
+            assert small.format == 'WEBP'
+            assert small.size == (480, 240)
+        with Image.open(media_root / image.variants['thumbnail']['original']) as thumbnail:
+            assert thumbnail.format == 'JPEG'
+
+    def test_variants_are_served_as_urls(self, api_client, media_root):
+        image = baker.make(ProductImage, image='store/products/images/a.jpg', variants={
+            'small': {'webp': 'store/products/images/variants/1/small.webp'}})
+
+        response = api_client.get(f'/store/products/{image.product_id}/images/{image.id}/')
+
+        assert response.data['variants'] == {
+            'small': {'webp': '/media/store/products/images/variants/1/small.webp'}}
+
+    def test_png_keeps_png_fallback_and_is_never_scaled_up(self, media_root):
+        product = baker.make(Product)
+        image = ProductImage.objects.create(
+            product=product, image=make_upload((100, 50), 'PNG', 'small.png'))
+
+        create_image_variants_task(image.id)
+
+        image.refresh_from_db()
+        with Image.open(media_root / image.variants['large']['original']) as large:
+            assert large.format == 'PNG'
+            assert large.size == (100, 50)
+
+    def test_unreadable_image_is_left_without_variants(self, media_root):
+        image = ProductImage.objects.create(
+            product=baker.make(Product), image=SimpleUploadedFile('bad.jpg', b'not an image'))
+
+        create_image_variants_task(image.id)
+
+        image.refresh_from_db()
+        assert image.variants == {}
+
+    def test_admin_thumbnail_uses_webp_variant(self):
+        image = baker.make(ProductImage, image='store/products/images/a.jpg', variants={
+            'thumbnail': {'webp': 'store/products/images/variants/1/thumbnail.webp'}})
+
+        html = ProductImageInline(Product, admin.site).thumbnail(image)
+
+        assert "src='/media/store/products/images/variants/1/thumbnail.webp'" in html
+
+
+@pytest.mark.django_db
+class TestProductImageUploads:
+    def upload(self, api_client, product, upload):
+        return api_client.post(f'/store/products/{product.id}/images/',
+                               {'image': upload}, format='multipart')
+
+    def test_oversize_upload_is_rejected_while_streaming(self, api_client, media_root, monkeypatch):
+        received = []
+        monkeypatch.setattr(ProductImageUploadHandler, 'chunk_size', 1024)
+        original = ProductImageUploadHandler.receive_data_chunk
+        monkeypatch.setattr(ProductImageUploadHandler, 'receive_data_chunk',
+                            lambda handler, data, start: received.append(len(data)) or original(handler, data, start))
+        product = baker.make(Product)
+        content = make_upload().read() + b'\0' * (MAX_IMAGE_SIZE_KB * 1024 * 2)
+
+        response = self.upload(api_client, product, SimpleUploadedFile('big.jpg', content))
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'image' in response.data
+        assert sum(received) <= MAX_IMAGE_SIZE_KB * 1024 + 1024
+        assert not ProductImage.objects.exists()
+
+    def test_content_type_is_sniffed_from_the_first_bytes(self, api_client, media_root):
+        product = baker.make(Product)
+        upload = SimpleUploadedFile('notes.jpg', b'just some text, not an image', 'image/jpeg')
+
+        response = self.upload(api_client, product, upload)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['image'] == ['Upload a JPEG, PNG, GIF or WebP image.']
+
+    def test_valid_upload_is_saved_to_storage(self, api_client, media_root):
+        product = baker.make(Product)
+
+        response = self.upload(api_client, product, make_upload(name='photo.jpg'))
+
+        assert response.status_code == status.HTTP_201_CREATED
+        image = ProductImage.objects.get(pk=response.data['id'])
+        assert (media_root / image.image.name).stat().st_size == image.image.size
+
+    def test_sniffer_recognizes_webp(self):
+        assert sniff_image_type(b'RIFF\0\0\0\0WEBPVP8 ') == 'image/webp'
+        assert sniff_image_type(b'<svg xmlns=') is None
@@ -0,0 +1,111 @@
+from io import StringIO
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from rest_framework import status
+from store.models import Category, Product
+from model_bakery import baker
+import pytest
+
+CSV = (
+    'title,slug,unit_price,description,inventory,category\n'
+    'Tea,tea,2.50,Green tea,10,Grocery\n'
+    'Soap,soap,1.00,Lavender soap,5,Beauty\n'
+    'Broken,broken,abc,Bad price,1,Grocery\n'
+)
+
+
+@pytest.fixture
+def import_products(api_client):
+    def do_import_products(content, name='products.csv', **data):
+        upload = SimpleUploadedFile(name, content.encode())
+        return api_client.post('/store/products/import/', {'file': upload, **data}, format='multipart')
+    return do_import_products
+
+
+@pytest.mark.django_db
+class TestImportProducts:
+    def test_if_user_is_not_admin_returns_403(self, authenticate, import_products):
+        authenticate()
+
+        response = import_products(CSV)
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_csv_rows_are_created_and_invalid_rows_reported(self, authenticate, import_products):
+        authenticate(is_staff=True)
+        grocery = baker.make(Category, title='Grocery')
+        baker.make(Category, title='Beauty')
+
+        response = import_products(CSV)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['created'] == 2
+        assert response.data['failed'] == 1
+        assert response.data['errors'][0]['line'] == 4
+        assert 'unit_price' in response.data['errors'][0]['errors']
+        grocery.refresh_from_db()
+        assert grocery.product_count == 1
+
+    def test_existing_slugs_are_updated(self, authenticate, import_products):
+        authenticate(is_staff=True)
+        category = baker.make(Category, title='Grocery')
+        product = baker.make(Product, slug='tea', unit_price=1)
+
+        response = import_products(
+            '{"title": "Tea", "slug": "tea", "unit_price": "3.20", "description": "a",'
+            ' "inventory": 1, "category": "Grocery"}\n\nnot json\n',
+            name='products.jsonl')
+
+        assert response.data['updated'] == 1
+        assert response.data['failed'] == 1
+        product.refresh_from_db()
+        assert str(product.unit_price) == '3.20'
+        assert product.category_id == category.id
+
+    def test_jsonl_numeric_prices_are_imported(self, authenticate, import_products):
+        authenticate(is_staff=True)
+        baker.make(Category, title='Grocery')
+
+        response = import_products(
+            '{"title": "Tea", "slug": "tea", "unit_price": 19.99, "description": "a",'
+            ' "inventory": 1, "category": "Grocery"}\n'
+            '{"title": "Soap", "slug": "soap", "unit_price": 3, "description": "b",'
+            ' "inventory": 2, "category": "Grocery"}\n',
+            name='products.jsonl')
+
+        assert response.data['created'] == 2
+        assert response.data['failed'] == 0
+        assert {slug: str(price) for slug, price in Product.objects.values_list('slug', 'unit_price')} == {
+            'tea': '19.99', 'soap': '3.00'}
+
+    def test_unknown_categories_are_rejected_unless_created(self, authenticate, import_products):
+        authenticate(is_staff=True)
+        baker.make(Category, title='Grocery')
+
+        rejected = import_products(CSV)
+        created = import_products(CSV, create_categories='true')
+
+        assert rejected.data['failed'] == 2
+        assert created.data['failed'] == 1
+        assert Category.objects.filter(title='Beauty').exists()
+
+    def test_unsupported_format_returns_400(self, authenticate, import_products):
+        authenticate(is_staff=True)
+
+        response = import_products(CSV, name='products.xlsx')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_import_command_reports_progress_per_batch(tmp_path):
+    baker.make(Category, title='Grocery')
+    path = tmp_path / 'products.csv'
+    path.write_text('title,slug,unit_price,description,inventory,category\n' + ''.join(
+        f'P{i},p{i},1.00,d,1,Grocery\n' for i in range(5)))
+    output = StringIO()
+
+    call_command('import_products', str(path), '--batch-size=2', stdout=output)
+
+    assert output.getvalue().count('rows:') == 3
+    assert Product.objects.count() == 5
@@ -0,0 +1,75 @@
+from decimal import Decimal
+from itertools import product as combinations
+from urllib.parse import urlencode
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from store.models import Category, Product
+from store.views import ProductViewSet
+import pytest
+
+PRODUCT_COUNT = 20000
+CATEGORY_COUNT = 50
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN {sql}')
+            return [row[0] for row in cursor.fetchall()]
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def is_product_table_scan(step):
+    if connection.vendor == 'postgresql':
+        return 'Seq Scan on store_product ' in f'{step} '
+    return step.strip() == 'SCAN store_product'
+
+
+@pytest.fixture
+def catalog():
+    categories = Category.objects.bulk_create(
+        [Category(title=f'category {index}') for index in range(CATEGORY_COUNT)])
+    Product.objects.bulk_create(
+        [Product(title=f'product {index:05}', slug=f'product-{index}',
+                 unit_price=Decimal(index % 1000 + 1), inventory=index % 50,
+                 category=categories[index % CATEGORY_COUNT])
+         for index in range(PRODUCT_COUNT)],
+        batch_size=1000)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    return categories
+
+
+def list_params(category):
+    # every filter and ordering combination ProductViewSet allows, in both pagination modes
+    filters = [{}, {'category_id': category.id},
+               {'unit_price__gt': 100, 'unit_price__lt': 102},
+               {'category_id': category.id, 'unit_price__gt': 100, 'unit_price__lt': 102}]
+    orderings = [{}] + [{'ordering': f'{direction}{field}'}
+                        for field in ProductViewSet.ordering_fields for direction in ['', '-']]
+    paginations = [{}, {'pagination': 'cursor'}]
+    for filter_params, ordering, pagination in combinations(filters, orderings, paginations):
+        yield {**filter_params, **ordering, **pagination}
+
+
+@pytest.mark.django_db
+class TestProductListQueryPlans:
+    def test_filters_and_orderings_do_not_scan_the_product_table(self, api_client, catalog):
+        scans = []
+        for params in list_params(catalog[0]):
+            url = f'/store/products/?{urlencode(params)}'
+            with CaptureQueriesContext(connection) as queries:
+                response = api_client.get(url)
+            assert response.status_code == 200, url
+
+            for query in queries.captured_queries:
+                sql = query['sql']
+                # unfiltered counts/aggregates read every row by definition
+                if 'FROM "store_product"' not in sql or not (' WHERE ' in sql or ' LIMIT ' in sql):
+                    continue
+                plan = explain(sql)
+                if any(is_product_table_scan(step) for step in plan):
+                    scans.append((url, sql, plan))
+
+        assert scans == []
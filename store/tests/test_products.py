@@ -1,6 +1,14 @@
+import csv
+import json
 from rest_framework import status
-from store.models import Product, Category, Customer
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from store.models import Product, Category, Customer, ProductImage
+from store.serializers import ProductSerializer
 from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.http import http_date
 from model_bakery import baker
 import pytest
 
@@ -208,3 +216,424 @@ class TestDeleteProduct:
         response = delete_product()
 
         assert response.status_code == status.HTTP_204_NO_CONTENT
+
+
+@pytest.mark.django_db
+class TestPaginateProducts:
+    def test_page_number_pagination_returns_count(self, api_client):
+        baker.make(Product, _quantity=12)
+
+        response = api_client.get('/store/products/?page=2')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == 12
+        assert len(response.data['results']) == 2
+
+    def test_cursor_pagination_returns_every_product_once(self, api_client):
+        category = baker.make(Category)
+        baker.make(Product, category=category, unit_price=5, _quantity=25)
+        seen = []
+
+        response = api_client.get(
+            '/store/products/?pagination=cursor&ordering=-unit_price')
+        while True:
+            assert response.status_code == status.HTTP_200_OK
+            assert 'count' not in response.data
+            seen += [product['id'] for product in response.data['results']]
+            if response.data['next'] is None:
+                break
+            response = api_client.get(response.data['next'])
+
+        assert len(seen) == 25
+        assert len(set(seen)) == 25
+
+    def test_cursor_pagination_falls_back_to_title_ordering(self, api_client):
+        for title in ['c', 'a', 'b']:
+            baker.make(Product, title=title)
+
+        response = api_client.get(
+            '/store/products/?pagination=cursor&ordering=inventory')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [product['title'] for product in response.data['results']] == [
+            'a', 'b', 'c']
+
+
+@pytest.mark.django_db
+class TestSearchProducts:
+    def test_search_matches_word_prefixes_in_any_indexed_field(self, api_client):
+        category = baker.make(Category, title='Bakery')
+        bread = baker.make(Product, title='Bread', description='fresh')
+        cake = baker.make(Product, title='Cake', category=category)
+        baker.make(Product, title='Soap', description='lavender')
+
+        response = api_client.get('/store/products/?search=bre')
+        assert [product['id'] for product in response.data['results']] == [bread.id]
+
+        response = api_client.get('/store/products/?search=bak')
+        assert [product['id'] for product in response.data['results']] == [cake.id]
+
+    def test_search_requires_every_term(self, api_client):
+        baker.make(Product, title='Red apple', description='sweet')
+        baker.make(Product, title='Green apple', description='sour')
+
+        response = api_client.get('/store/products/?search=apple sour')
+
+        assert [product['title'] for product in response.data['results']] == [
+            'Green apple']
+
+    def test_search_ranks_title_matches_first(self, api_client):
+        in_description = baker.make(
+            Product, title='Basket', description='holds bread')
+        in_title = baker.make(Product, title='Bread', description='plain')
+
+        response = api_client.get('/store/products/?search=bread')
+
+        assert [product['id'] for product in response.data['results']] == [
+            in_title.id, in_description.id]
+
+    def test_search_combines_with_filters(self, api_client):
+        category = baker.make(Category)
+        baker.make(Product, title='Tea', unit_price=5)
+        match = baker.make(Product, title='Tea', unit_price=5,
+                           category=category)
+        baker.make(Product, title='Tea', unit_price=50, category=category)
+
+        response = api_client.get(
+            f'/store/products/?search=tea&category_id={category.id}&unit_price__lt=10')
+
+        assert [product['id'] for product in response.data['results']] == [match.id]
+
+    def test_search_reflects_renamed_category(self, api_client):
+        category = baker.make(Category, title='Toys')
+        product = baker.make(Product, category=category)
+        api_client.get('/store/products/?search=toys')
+
+        category.title = 'Games'
+        category.save()
+        response = api_client.get('/store/products/?search=games')
+
+        assert [item['id'] for item in response.data['results']] == [product.id]
+
+
+@pytest.mark.django_db
+class TestCacheProducts:
+    def test_repeated_list_is_served_from_cache(self, api_client, django_assert_num_queries):
+        baker.make(Product, _quantity=3)
+        first = api_client.get('/store/products/?category_id=&page=1')
+
+        with django_assert_num_queries(0):
+            second = api_client.get('/store/products/?page=1&_=123')
+
+        assert second.status_code == status.HTTP_200_OK
+        assert second.data == first.data
+
+    def test_product_update_invalidates_cached_detail(self, authenticate, api_client):
+        product = baker.make(Product, title='old')
+        api_client.get(f'/store/products/{product.id}/')
+        authenticate(is_staff=True)
+
+        api_client.patch(f'/store/products/{product.id}/', {'title': 'new'})
+        response = api_client.get(f'/store/products/{product.id}/')
+
+        assert response.data['title'] == 'new'
+
+    def test_new_product_invalidates_cached_list(self, api_client):
+        category = baker.make(Category)
+        api_client.get('/store/products/')
+
+        baker.make(Product, category=category)
+        response = api_client.get('/store/products/')
+
+        assert response.data['count'] == 1
+
+    def test_different_filters_are_cached_separately(self, api_client):
+        baker.make(Product, unit_price=5)
+        baker.make(Product, unit_price=50)
+
+        cheap = api_client.get('/store/products/?unit_price__lt=10')
+        expensive = api_client.get('/store/products/?unit_price__gt=10')
+
+        assert cheap.data['count'] == 1
+        assert expensive.data['count'] == 1
+        assert cheap.data['results'][0]['id'] != expensive.data['results'][0]['id']
+
+
+@pytest.mark.django_db
+class TestConditionalGetProducts:
+    def test_detail_returns_304_for_matching_etag(self, api_client):
+        product = baker.make(Product)
+        response = api_client.get(f'/store/products/{product.id}/')
+
+        response = api_client.get(
+            f'/store/products/{product.id}/', HTTP_IF_NONE_MATCH=response['ETag'])
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response['Last-Modified'] is not None
+
+    def test_detail_returns_200_after_update(self, api_client):
+        product = baker.make(Product)
+        etag = api_client.get(f'/store/products/{product.id}/')['ETag']
+
+        product.title = 'changed'
+        product.save()
+        response = api_client.get(
+            f'/store/products/{product.id}/', HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response['ETag'] != etag
+
+    def test_list_304_is_answered_without_serializing(self, api_client, django_assert_num_queries):
+        baker.make(Product, _quantity=3)
+        etag = api_client.get('/store/products/')['ETag']
+        cache.clear()
+
+        # a single aggregate when the validators are not cached
+        with django_assert_num_queries(1):
+            response = api_client.get(
+                '/store/products/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+        with django_assert_num_queries(0):
+            response = api_client.get(
+                '/store/products/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_list_etag_changes_when_a_product_is_deleted(self, api_client):
+        products = baker.make(Product, _quantity=2)
+        etag = api_client.get('/store/products/')['ETag']
+
+        products[0].delete()
+        response = api_client.get('/store/products/', HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_list_is_validated_by_etag_only(self, api_client):
+        products = baker.make(Product, _quantity=2)
+        products[0].delete()
+
+        # no product changed after the If-Modified-Since date, yet the list did
+        response = api_client.get(
+            '/store/products/', HTTP_IF_MODIFIED_SINCE=http_date(timezone.now().timestamp()))
+
+        assert not response.has_header('Last-Modified')
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_list_etag_depends_on_filters(self, api_client):
+        category = baker.make(Category)
+        baker.make(Product, category=category)
+        etag = api_client.get('/store/products/')['ETag']
+
+        response = api_client.get(
+            f'/store/products/?category_id={category.id}', HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_bulk_update_changes_etags(self, api_client):
+        product = baker.make(Product, inventory=5)
+        detail_etag = api_client.get(f'/store/products/{product.id}/')['ETag']
+        list_etag = api_client.get('/store/products/')['ETag']
+
+        # like the admin "Clear Inventory" action
+        Product.objects.filter(pk=product.id).update(inventory=0)
+        detail = api_client.get(f'/store/products/{product.id}/', HTTP_IF_NONE_MATCH=detail_etag)
+        listing = api_client.get('/store/products/', HTTP_IF_NONE_MATCH=list_etag)
+
+        assert detail.status_code == listing.status_code == status.HTTP_200_OK
+        assert detail.data['inventory'] == 0
+
+    def test_new_image_changes_product_etag(self, api_client):
+        product = baker.make(Product)
+        etag = api_client.get(f'/store/products/{product.id}/')['ETag']
+
+        baker.make('ProductImage', product=product)
+        response = api_client.get(
+            f'/store/products/{product.id}/', HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+class TestSparseFieldsets:
+    def test_fields_limits_the_output(self, api_client):
+        product = baker.make(Product)
+
+        response = api_client.get(
+            f'/store/products/{product.id}/?fields=id,title,unit_price')
+
+        assert list(response.data) == ['id', 'title', 'unit_price']
+
+    def test_omit_drops_fields(self, api_client):
+        product = baker.make(Product)
+
+        response = api_client.get(
+            f'/store/products/{product.id}/?omit=description,images')
+
+        assert 'description' not in response.data
+        assert 'images' not in response.data
+        assert 'price_inc_tax' in response.data
+
+    def test_skipped_fields_are_not_queried(self, api_client, django_assert_num_queries):
+        baker.make(Product, _quantity=3)
+
+        # etag aggregate, count, page and the page's promotions:
+        # no images prefetch, no description column
+        with django_assert_num_queries(4) as context:
+            response = api_client.get(
+                '/store/products/?fields=id,title,unit_price,price_inc_tax')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert all('description' not in query['sql']
+                   for query in context.captured_queries)
+
+    @pytest.mark.parametrize('url', ['/store/products/', '/store/products/{id}/'])
+    @pytest.mark.parametrize('param', ['fields', 'omit'])
+    def test_unknown_fields_return_400(self, api_client, url, param):
+        product = baker.make(Product)
+
+        response = api_client.get(f'{url.format(id=product.id)}?{param}=title,foo')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data == {param: ['Unknown fields: foo.']}
+
+    def test_full_representation_is_the_default(self, api_client):
+        product = baker.make(Product)
+
+        response = api_client.get(f'/store/products/{product.id}/')
+
+        assert list(response.data) == ['id', 'title', 'slug', 'unit_price', 'description',
+                                       'inventory', 'price_inc_tax', 'category', 'images',
+                                       'rating_avg', 'rating_count', 'rating_histogram']
+
+
+@pytest.mark.django_db
+class TestProductListSerialization:
+    def render_with_serializer(self, response, queryset):
+        serializer = ProductSerializer(
+            queryset, many=True, context={'request': Request(response.wsgi_request)})
+        return JSONRenderer().render(serializer.data)
+
+    def test_list_output_is_byte_identical_to_product_serializer(self, api_client):
+        category = baker.make(Category)
+        for price in ['19.99', '0.10', '1234.50']:
+            product = baker.make(Product, category=category, unit_price=price)
+            baker.make(ProductImage, product=product,
+                       image='store/products/images/a.jpg', _quantity=2)
+        baker.make(Product, category=category, unit_price=3)
+
+        response = api_client.get('/store/products/?ordering=unit_price')
+
+        assert JSONRenderer().render(response.data['results']) == \
+            self.render_with_serializer(
+                response, Product.objects.order_by('unit_price'))
+
+    def test_sparse_list_output_matches_product_serializer(self, api_client):
+        baker.make(Product, unit_price='2.35', _quantity=3)
+
+        response = api_client.get(
+            '/store/products/?fields=id,price_inc_tax,images&pagination=cursor')
+
+        assert JSONRenderer().render(response.data['results']) == \
+            self.render_with_serializer(response, Product.objects.all())
+
+
+@pytest.mark.django_db
+class TestExportProducts:
+    def test_if_user_is_not_admin_returns_403(self, authenticate, api_client):
+        authenticate()
+
+        response = api_client.get('/store/products/export/')
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_ndjson_streams_the_filtered_products(self, authenticate, api_client):
+        authenticate(is_staff=True)
+        category = baker.make(Category)
+        products = baker.make(Product, category=category, _quantity=3)
+        baker.make(Product)
+        baker.make(ProductImage, product=products[0],
+                   image='store/products/images/a.jpg')
+
+        response = api_client.get(
+            f'/store/products/export/?category_id={category.id}')
+        lines = b''.join(response.streaming_content).splitlines()
+
+        assert response['Content-Type'] == 'application/x-ndjson'
+        exported = [json.loads(line) for line in lines]
+        assert sorted(item['id'] for item in exported) == sorted(
+            product.id for product in products)
+        assert sum(len(item['images']) for item in exported) == 1
+
+    def test_csv_has_a_header_and_one_row_per_product(self, authenticate, api_client):
+        authenticate(is_staff=True)
+        baker.make(Product, _quantity=2)
+
+        response = api_client.get(
+            '/store/products/export/?output=csv&fields=id,title,images')
+        rows = list(csv.reader(
+            b''.join(response.streaming_content).decode().splitlines()))
+
+        assert rows[0] == ['id', 'title', 'images']
+        assert len(rows) == 3
+
+    def test_csv_rating_histogram_has_a_column_per_star(self, authenticate, api_client):
+        authenticate(is_staff=True)
+        product = baker.make(Product, rating_2=1, rating_5=3)
+
+        response = api_client.get(
+            '/store/products/export/?output=csv&fields=id,rating_histogram')
+        rows = list(csv.reader(
+            b''.join(response.streaming_content).decode().splitlines()))
+
+        assert rows == [['id', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5'],
+                        [str(product.id), '0', '1', '0', '0', '3']]
+
+    def test_unknown_output_returns_400(self, authenticate, api_client):
+        authenticate(is_staff=True)
+
+        response = api_client.get('/store/products/export/?output=xml')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+class TestProductFacets:
+    def test_counts_categories_and_price_buckets_in_one_query(self, api_client, django_assert_num_queries):
+        food, drinks = baker.make(Category, _quantity=2)
+        baker.make(Product, category=food, unit_price=5, _quantity=2)
+        baker.make(Product, category=food, unit_price=30)
+        baker.make(Product, category=drinks, unit_price=150)
+
+        with django_assert_num_queries(1):
+            response = api_client.get('/store/products/facets/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == 4
+        assert response.data['categories'] == [
+            {'id': food.id, 'count': 3}, {'id': drinks.id, 'count': 1}]
+        assert [bucket['count'] for bucket in response.data['unit_price']] == [2, 0, 1, 0, 1]
+        assert response.data['unit_price'][0] == {'min': None, 'max': 10, 'count': 2}
+
+    def test_facets_follow_filters_and_search(self, api_client):
+        category = baker.make(Category)
+        baker.make(Product, category=category, title='green tea', unit_price=5)
+        baker.make(Product, category=category, title='black tea', unit_price=60)
+        baker.make(Product, category=category, title='soap', unit_price=5)
+
+        response = api_client.get('/store/products/facets/?search=tea&unit_price__lt=50')
+
+        assert response.data['count'] == 1
+        assert response.data['categories'] == [{'id': category.id, 'count': 1}]
+
+    def test_facets_are_cached_per_filter_until_catalog_changes(self, api_client, django_assert_num_queries):
+        category = baker.make(Category)
+        baker.make(Product, category=category, unit_price=5)
+        api_client.get('/store/products/facets/?unit_price__lt=10&page=2')
+
+        with django_assert_num_queries(0):
+            cached = api_client.get('/store/products/facets/?page=3&unit_price__lt=10')
+        baker.make(Product, category=category, unit_price=7)
+        fresh = api_client.get('/store/products/facets/?unit_price__lt=10')
+
+        assert cached.data['count'] == 1
+        assert fresh.data['count'] == 2
@@ -0,0 +1,160 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework import status
+from store.models import Product, Review
+from model_bakery import baker
+import pytest
+
+
+@pytest.fixture
+def create_review(api_client):
+    def do_create_review(product, rating):
+        return api_client.post(f'/store/products/{product.id}/reviews/',
+                               {'rating': rating, 'comment': 'ok'})
+    return do_create_review
+
+
+@pytest.mark.django_db
+class TestProductRatings:
+    def test_created_reviews_update_the_product_rating(self, create_review):
+        product = baker.make(Product)
+
+        for rating in [5, 4, 4]:
+            assert create_review(product, rating).status_code == status.HTTP_201_CREATED
+
+        product.refresh_from_db()
+        assert product.rating_count == 3
+        assert product.rating_avg == Decimal('4.33')
+        assert (product.rating_4, product.rating_5, product.rating_1) == (2, 1, 0)
+
+    def test_changed_rating_moves_between_stars(self, api_client, create_review):
+        product = baker.make(Product)
+        review_id = create_review(product, 1).data['id']
+
+        api_client.patch(f'/store/products/{product.id}/reviews/{review_id}/', {'rating': 3})
+
+        product.refresh_from_db()
+        assert (product.rating_1, product.rating_3, product.rating_count) == (0, 1, 1)
+        assert product.rating_avg == Decimal('3.00')
+
+    def test_deleted_review_is_removed_from_the_rating(self, api_client, create_review):
+        product = baker.make(Product)
+        create_review(product, 2)
+        review_id = create_review(product, 4).data['id']
+
+        api_client.delete(f'/store/products/{product.id}/reviews/{review_id}/')
+
+        product.refresh_from_db()
+        assert (product.rating_count, product.rating_4, product.rating_avg) == (1, 0, Decimal('2.00'))
+
+    def test_last_review_deleted_resets_average(self, api_client, create_review):
+        product = baker.make(Product)
+        review_id = create_review(product, 5).data['id']
+
+        api_client.delete(f'/store/products/{product.id}/reviews/{review_id}/')
+
+        product.refresh_from_db()
+        assert (product.rating_count, product.rating_avg) == (0, Decimal('0'))
+
+    def test_product_exposes_rating_fields(self, api_client, create_review):
+        product = baker.make(Product)
+        create_review(product, 5)
+
+        detail = api_client.get(f'/store/products/{product.id}/')
+        listed = api_client.get('/store/products/')
+
+        for data in [detail.data, listed.data['results'][0]]:
+            assert data['rating_avg'] == Decimal('5.00')
+            assert data['rating_count'] == 1
+            assert data['rating_histogram'] == {'1': 0, '2': 0, '3': 0, '4': 0, '5': 1}
+
+    def test_products_can_be_ordered_by_rating(self, api_client, create_review):
+        low, high = baker.make(Product, _quantity=2)
+        create_review(low, 2)
+        create_review(high, 5)
+
+        response = api_client.get('/store/products/?ordering=-rating_avg')
+        cursor = api_client.get('/store/products/?ordering=-rating_avg&pagination=cursor')
+
+        assert [item['id'] for item in response.data['results']] == [high.id, low.id]
+        assert [item['id'] for item in cursor.data['results']] == [high.id, low.id]
+
+    def test_rebuild_command_repairs_ratings(self):
+        product = baker.make(Product)
+        baker.make(Review, product=product, rating=3, _quantity=2)
+        Product.objects.update(rating_count=0, rating_3=0, rating_avg=0)
+
+        out = StringIO()
+        call_command('rebuild_product_ratings', stdout=out)
+
+        product.refresh_from_db()
+        assert (product.rating_count, product.rating_3, product.rating_avg) == (2, 2, Decimal('3.00'))
+        assert 'Rebuilt ratings for 1 products.' in out.getvalue()
+
+
+@pytest.mark.django_db
+class TestListReviews:
+    def test_reviews_are_cursor_paginated_newest_first(self, api_client):
+        product = baker.make(Product)
+        now = timezone.now()
+        reviews = baker.make(Review, product=product, rating=3, _quantity=25)
+        for index, review in enumerate(reviews):
+            Review.objects.filter(pk=review.pk).update(date=now - timedelta(days=index))
+
+        first = api_client.get(f'/store/products/{product.id}/reviews/')
+        second = api_client.get(first.data['next'])
+
+        assert [item['id'] for item in first.data['results'] + second.data['results']] == [
+            review.id for review in reviews]
+        assert len(first.data['results']) == 20
+        assert second.data['next'] is None
+
+    def test_reviews_can_be_filtered_by_rating(self, api_client):
+        product = baker.make(Product)
+        baker.make(Review, product=product, rating=1)
+        good = baker.make(Review, product=product, rating=4)
+        best = baker.make(Review, product=product, rating=5)
+
+        at_least_four = api_client.get(f'/store/products/{product.id}/reviews/?rating__gte=4')
+        exactly_five = api_client.get(f'/store/products/{product.id}/reviews/?rating=5')
+
+        assert {item['id'] for item in at_least_four.data['results']} == {good.id, best.id}
+        assert [item['id'] for item in exactly_five.data['results']] == [best.id]
+
+
+@pytest.mark.django_db
+class TestTopReviews:
+    def test_summary_has_ratings_and_best_reviews(self, api_client, create_review):
+        product = baker.make(Product)
+        for rating in [2, 5, 4, 5]:
+            create_review(product, rating)
+
+        response = api_client.get(f'/store/products/{product.id}/reviews/top/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['rating_count'] == 4
+        assert response.data['rating_avg'] == Decimal('4.00')
+        assert [review['rating'] for review in response.data['reviews']] == [5, 5, 4]
+
+    def test_summary_is_cached_until_a_review_changes(self, api_client, create_review,
+                                                      django_assert_num_queries):
+        product = baker.make(Product)
+        create_review(product, 3)
+        api_client.get(f'/store/products/{product.id}/reviews/top/')
+
+        with django_assert_num_queries(0):
+            cached = api_client.get(f'/store/products/{product.id}/reviews/top/')
+        create_review(product, 5)
+        fresh = api_client.get(f'/store/products/{product.id}/reviews/top/')
+
+        assert cached.data['rating_count'] == 1
+        assert fresh.data['rating_count'] == 2
+        assert fresh.data['reviews'][0]['rating'] == 5
+
+    def test_unknown_product_returns_404(self, api_client):
+        response = api_client.get('/store/products/0/reviews/top/')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
@@ -0,0 +1,83 @@
+from tempfile import SpooledTemporaryFile
+
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from rest_framework.exceptions import ValidationError
+
+from .validators import MAX_IMAGE_SIZE_KB
+
+# magic numbers of the formats product images may use
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+SNIFF_BYTES = 12
+
+
+def sniff_image_type(head):
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, content_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    return None
+
+
+class ProductImageUploadHandler(FileUploadHandler):
+    """
+    Receives product image uploads chunk by chunk. The upload is rejected as
+    soon as it crosses MAX_IMAGE_SIZE_KB or its first bytes are not a known
+    image format (the client's content type is ignored), so no more than the
+    limit is ever held: in memory up to spool_size, in a temp file past it.
+    The model save streams the file on to the storage backend.
+    """
+    chunk_size = 64 * 2 ** 10
+    spool_size = 256 * 2 ** 10
+    max_size = MAX_IMAGE_SIZE_KB * 1024
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if self.content_length is not None and self.content_length > self.max_size:
+            self.reject_size()
+        self.file = SpooledTemporaryFile(max_size=self.spool_size)
+        self.head = b''
+        self.sniffed_type = None
+        self.received = 0
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            self.file.close()
+            self.reject_size()
+        if self.sniffed_type is None and len(self.head) < SNIFF_BYTES:
+            self.head += raw_data[:SNIFF_BYTES - len(self.head)]
+            if len(self.head) == SNIFF_BYTES:
+                self.sniff()
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        if self.sniffed_type is None:
+            self.sniff()
+        self.file.seek(0)
+        return UploadedFile(
+            file=self.file,
+            name=self.file_name,
+            content_type=self.sniffed_type,
+            size=file_size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra,
+        )
+
+    def sniff(self):
+        self.sniffed_type = sniff_image_type(self.head)
+        if self.sniffed_type is None:
+            self.file.close()
+            raise ValidationError(
+                {self.field_name: ['Upload a JPEG, PNG, GIF or WebP image.']})
+
+    def reject_size(self):
+        raise ValidationError(
+            {self.field_name: [f'The image specified cannot be larger than {MAX_IMAGE_SIZE_KB}KB']})
@@ -7,6 +7,7 @@ router.register('categories', CategoryViewSet)
 router.register('customers', CustomerViewSet)
 router.register('carts', CartViewSet, basename='carts')
 router.register('orders', OrderViewSet, basename='orders')
+router.register('checkouts', CheckoutViewSet, basename='checkouts')
 
 products_router = routers.NestedDefaultRouter(
     router, 'products', lookup='product')
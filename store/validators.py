@@ -1,8 +1,10 @@
 from django.core.exceptions import ValidationError
 
+MAX_IMAGE_SIZE_KB = 1000
+
 
 def validate_file_size(file):
-    max_size_kb = 1000
+    max_size_kb = MAX_IMAGE_SIZE_KB
 
     if file.size > max_size_kb * 1024:
         raise ValidationError(
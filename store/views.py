@@ -1,29 +1,53 @@
 from urllib import request
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework import status
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from rest_framework.mixins import ListModelMixin, UpdateModelMixin, CreateModelMixin, RetrieveModelMixin, DestroyModelMixin
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated, IsAdminUser, AllowAny
-from django.db.models import Count
-# from django.shortcuts import get_object_or_404
+from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated, IsAdminUser, AllowAny, SAFE_METHODS
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, Count, IntegerField, Max, Prefetch, Value, When
+from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import Http404, StreamingHttpResponse
+from rest_framework.parsers import MultiPartParser
 
 from store.permissions import IsAdminOrReadOnly
+from .bulk import ProductImporter, SerializerRows, bulk_update_products, export_csv, export_ndjson, get_import_format, read_rows
+from .carts import get_cart_store, parse_cart_id
+from .caching import CatalogCacheMixin, catalog_cache_key, get_catalog_version, normalize_query_params, top_reviews_cache_key
+from .conditional import ConditionalGetMixin, make_etag
 from .filters import *
+from .idempotency import idempotent
 from .serializers import *
-from .models import Category, Customer, Order, OrderItem, Product, Review, Cart
-from .paginations import ProductPagination
+from .models import RATING_STARS, Category, Checkout, Customer, Order, OrderItem, Product, Review, rating_histogram_field
+from .paginations import OrderCursorPagination, ProductCursorPagination, ProductPagination, ReviewCursorPagination
+from .row_serializers import ProductRowSerializer, RowListMixin
+from .search import ProductSearchFilter
+from .uploads import ProductImageUploadHandler
 
 # CRUD VIEWSETS
 # Inherit from ReadOnlyModelViewSet if you don't need CUD
 
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ConditionalGetMixin, CatalogCacheMixin, RowListMixin, ModelViewSet):
     permission_classes = [IsAdminOrReadOnly]
     serializer_class = ProductSerializer
+    # list() serializes values() rows, see row_serializers.py
+    row_serializer_class = ProductRowSerializer
+    row_extra_columns = ProductCursorPagination.ordering_fields
+    # params that shape list/retrieve responses, used to build cache keys
+    cache_query_params = ['category_id', 'unit_price__gt', 'unit_price__lt',
+                          'search', 'ordering', 'page', 'pagination', 'cursor',
+                          'fields', 'omit']
+    # columns only read for their own serializer field, deferred when it is not requested
+    # (ordering and price columns stay loaded for pagination and price_inc_tax)
+    deferrable_fields = ['slug', 'description', 'inventory']
 
     # automatic filtering with url params:
     # def get_queryset(self):
@@ -31,17 +55,163 @@ class ProductViewSet(ModelViewSet):
     #         return Product.objects.filter(category_id=self.request.query_params.get('category_id'))
     #     return Product.objects.all()
     # or when filters get many (better way): set queryset to .all and:
-    queryset = Product.objects.prefetch_related('images').all()
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    queryset = Product.objects.defer('search_vector')
+    # ?search= is served by the indexed, relevance ranked filter in search.py
+    # (title, description and category title are the indexed fields)
+    filter_backends = [DjangoFilterBackend,
+                       ProductSearchFilter, OrderingFilter]
     filterset_class = ProductFilter
     pagination_class = ProductPagination
-    search_fields = ['title', 'description', 'category__title']
-    ordering_fields = ['unit_price', 'last_updated']
+    # rating_avg is a stored column (see Product), ordering by it needs no join
+    ordering_fields = ['unit_price', 'last_updated', 'rating_avg']
     # then create filters.py and create ProductFilter
 
     def get_context_data(self, request):
         return {'context': request}
 
+    # ?fields= / ?omit= also trim the query: skipped columns are deferred
+    # and images are only prefetched when they are serialized
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method not in SAFE_METHODS:
+            return queryset.prefetch_related('images')
+        fields = get_requested_fields(
+            self.request.query_params, ProductSerializer.Meta.fields)
+        deferred = [name for name in self.deferrable_fields if name not in fields]
+        if deferred:
+            queryset = queryset.defer(*deferred)
+        if 'images' in fields:
+            queryset = queryset.prefetch_related('images')
+        return queryset
+
+    # ETag/Last-Modified come from one cheap query (cached under the catalog
+    # version), so 304s never touch the serializer. Lists only get an ETag: the
+    # newest last_updated does not move when a product is deleted or leaves the
+    # filter, so Last-Modified could answer 304 to a changed list
+    def get_validators(self, request):
+        params = normalize_query_params(
+            request.query_params, self.cache_query_params)
+        parts = [self.action, self.kwargs.get('pk', ''), request.get_host(),
+                 request.accepted_renderer.format, params]
+        return cache.get_or_set(
+            catalog_cache_key('validators', *parts),
+            lambda: self.compute_validators(parts),
+            settings.CATALOG_CACHE_TIMEOUT
+        )
+
+    def compute_validators(self, parts):
+        if self.action == 'retrieve':
+            try:
+                last_updated = Product.objects.filter(pk=self.kwargs['pk']).values_list(
+                    'last_updated', flat=True).first()
+            except (TypeError, ValueError):
+                last_updated = None
+            if last_updated is None:
+                return None, None
+            count = 1
+            etag = make_etag(*parts, count, last_updated.isoformat())
+            return etag, last_updated
+        stats = self.filter_queryset(self.get_queryset()).order_by().aggregate(
+            last_updated=Max('last_updated'), count=Count('id'))
+        last_updated, count = stats['last_updated'], stats['count']
+        etag = make_etag(*parts, count,
+                         last_updated.isoformat() if last_updated else '')
+        return etag, None
+
+    # sidebar counts for the current ?search= and ProductFilter params: products
+    # per category and per unit_price bucket, from one query grouped by both
+    facet_query_params = ['category_id', 'unit_price__gt', 'unit_price__lt', 'search']
+    price_facet_edges = [10, 25, 50, 100]
+
+    @action(detail=False)
+    def facets(self, request):
+        key = catalog_cache_key('facets', normalize_query_params(
+            request.query_params, self.facet_query_params))
+        return Response(cache.get_or_set(key, self.compute_facets, settings.CATALOG_CACHE_TIMEOUT))
+
+    def compute_facets(self):
+        edges = self.price_facet_edges
+        bucket = Case(
+            *[When(unit_price__lt=edge, then=Value(index)) for index, edge in enumerate(edges)],
+            default=Value(len(edges)), output_field=IntegerField())
+        groups = self.filter_queryset(self.get_queryset()).prefetch_related(None).order_by().values(
+            'category_id', price_bucket=bucket).annotate(count=Count('id'))
+
+        categories, buckets, total = {}, [0] * (len(edges) + 1), 0
+        for group in groups:
+            categories[group['category_id']] = categories.get(
+                group['category_id'], 0) + group['count']
+            buckets[group['price_bucket']] += group['count']
+            total += group['count']
+        bounds = [None] + edges + [None]
+        return {
+            'count': total,
+            'categories': [{'id': category_id, 'count': count}
+                           for category_id, count in sorted(categories.items())],
+            'unit_price': [{'min': bounds[index], 'max': bounds[index + 1], 'count': count}
+                           for index, count in enumerate(buckets)],
+        }
+
+    # staff upload of a supplier catalog: multipart `file` (.csv, .jsonl),
+    # optional `format` and `create_categories`
+    @action(detail=False, methods=['POST'], url_path='import',
+            permission_classes=[IsAdminUser], parser_classes=[MultiPartParser])
+    def import_products(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'file': ['No file was submitted.']}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            file_format = get_import_format(
+                upload.name, request.data.get('format'))
+        except DjangoValidationError as error:
+            return Response({'format': error.messages}, status=status.HTTP_400_BAD_REQUEST)
+        importer = ProductImporter(
+            create_categories=request.data.get('create_categories') in ['true', '1'])
+        result = importer.run(read_rows(upload.file, file_format))
+        return Response(result, status=status.HTTP_200_OK)
+
+    # staff bulk change of unit_price/inventory: a JSON list of {id, unit_price?, inventory?}.
+    # valid rows are applied together, every row gets a result
+    @action(detail=False, methods=['POST'], url_path='bulk-update', permission_classes=[IsAdminUser])
+    def bulk_update(self, request):
+        if not isinstance(request.data, list):
+            return Response({'non_field_errors': ['Expected a list of products.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        results, changes = [], []
+        for item in request.data:
+            serializer = ProductBulkUpdateSerializer(data=item)
+            if serializer.is_valid():
+                changes.append(serializer.validated_data)
+                results.append(None)
+            else:
+                results.append({'id': item.get('id') if isinstance(item, dict) else None,
+                                'status': 'invalid', 'errors': serializer.errors})
+        applied = iter(bulk_update_products(changes))
+        return Response([result or next(applied) for result in results], status=status.HTTP_200_OK)
+
+    # staff export of the filtered catalog (same params as the list), streamed
+    # in chunks so memory stays flat: ?output=ndjson (default) or ?output=csv
+    export_formats = {
+        'ndjson': (export_ndjson, 'application/x-ndjson'),
+        'csv': (export_csv, 'text/csv'),
+    }
+    export_chunk_size = 2000
+
+    @action(detail=False, methods=['GET'], permission_classes=[IsAdminUser])
+    def export(self, request):
+        output = request.query_params.get('output', 'ndjson')
+        if output not in self.export_formats:
+            return Response({'output': [f'Choose one of: {", ".join(self.export_formats)}.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        exporter, content_type = self.export_formats[output]
+        row_serializer = self.get_row_serializer()
+        rows = row_serializer.get_rows(
+            self.filter_queryset(self.get_queryset()))
+        response = StreamingHttpResponse(
+            exporter(row_serializer, rows, self.export_chunk_size), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="products.{output}"'
+        return response
+
     def destroy(self, request, *args, **kwargs):
         if OrderItem.objects.filter(product_id=kwargs['pk']).count() > 0:
             return Response({'error': 'Product has been ordered before and hence, cannot be deleted'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -51,6 +221,11 @@ class ProductViewSet(ModelViewSet):
 class ProductImageViewSet(ModelViewSet):
     serializer_class = ProductImageSerializer
 
+    # uploads are size capped and type checked while they stream in, see uploads.py
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [ProductImageUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
     # get the product id from the url:
     def get_queryset(self):
         return ProductImage.objects.filter(product_id=self.kwargs['product_pk'])
@@ -60,16 +235,25 @@ class ProductImageViewSet(ModelViewSet):
         return {'product_id': self.kwargs['product_pk']}
 
 
-class CategoryViewSet(ModelViewSet):
+class CategoryViewSet(ConditionalGetMixin, RowListMixin, ModelViewSet):
     permission_classes = [IsAdminOrReadOnly]
-    queryset = Category.objects.annotate(
-        product_count=Count('products')
-    )
+    # product_count is a stored counter, no join over the products table
+    queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
     def get_context_data(self, request):
         return {'context': request}
 
+    # categories have no timestamp, any catalog write changes the version
+    def get_validators(self, request):
+        etag = make_etag(
+            self.action,
+            self.kwargs.get('pk', ''),
+            request.accepted_renderer.format,
+            get_catalog_version()
+        )
+        return etag, None
+
     def destroy(self, request, *args, **kwargs):
         if Product.objects.filter(category_id=kwargs['pk']).count() > 0:
             return Response({'error': 'Category has been assigned to some products and hence, cannot be deleted'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -78,6 +262,11 @@ class CategoryViewSet(ModelViewSet):
 
 class ReviewViewSet(ModelViewSet):
     serializer_class = ReviewSerializer
+    # newest first in cursor pages, ?rating= / ?rating__gte= / ?rating__lte=
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = ReviewFilter
+    pagination_class = ReviewCursorPagination
+    top_reviews_count = 3
 
     # get the product id from the url:
     def get_queryset(self):
@@ -87,12 +276,44 @@ class ReviewViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {'product_id': self.kwargs['product_pk']}
 
+    # the product page summary: stored rating stats and the best, newest reviews.
+    # cached until a review of the product changes (see signals.py)
+    @action(detail=False)
+    def top(self, request, product_pk=None):
+        key = top_reviews_cache_key(product_pk)
+        data = cache.get(key)
+        if data is None:
+            product = get_object_or_404(Product.objects.only(
+                'id', 'rating_avg', 'rating_count', *map(rating_histogram_field, RATING_STARS)), pk=product_pk)
+            reviews = self.get_queryset().order_by(
+                '-rating', '-date', '-id')[:self.top_reviews_count]
+            data = {
+                'rating_avg': product.rating_avg,
+                'rating_count': product.rating_count,
+                'rating_histogram': ProductSerializer().get_rating_histogram(product),
+                'reviews': ReviewSerializer(reviews, many=True).data,
+            }
+            cache.set(key, data, settings.CATALOG_CACHE_TIMEOUT)
+        return Response(data)
+
 
 class CartViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
     serializer_class = CartSerializer
 
-    def get_queryset(self):
-        return Cart.objects.prefetch_related('cartitems__product').all()
+    # carts live in the configured cart store (settings.CART_STORE, see carts.py)
+    # and only reach the order tables at checkout
+    def get_object(self):
+        cart_id = parse_cart_id(self.kwargs['pk'])
+        cart = get_cart_store().get(cart_id) if cart_id else None
+        if cart is None:
+            raise Http404
+        return cart
+
+    def perform_create(self, serializer):
+        serializer.instance = get_cart_store().create()
+
+    def perform_destroy(self, instance):
+        get_cart_store().delete(instance.id)
 
 
 class CartItemViewSet(ModelViewSet):
@@ -106,13 +327,51 @@ class CartItemViewSet(ModelViewSet):
             return UpdateCartItemSerializer
         return AddCartItemSerializer
 
-    # get the cart id from the url:
-    def get_queryset(self):
-        return CartItem.objects.select_related('product').filter(cart_id=self.kwargs['cart_pk'])
-    # give the serializer the cart id from the url:
+    # get the cart id from the url, unknown carts are a 404 for every method:
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.cart_id = parse_cart_id(self.kwargs['cart_pk'])
+        self.cart_store = get_cart_store()
+        if self.cart_id is None or not self.cart_store.exists(self.cart_id):
+            raise Http404
+
+    def list(self, request, *args, **kwargs):
+        cart = self.cart_store.get(self.cart_id)
+        if cart is None:
+            raise Http404
+        return Response(self.get_serializer(cart.items, many=True).data)
+
+    def get_object(self):
+        try:
+            item_id = int(self.kwargs['pk'])
+        except ValueError:
+            raise Http404
+        item = self.cart_store.get_item(self.cart_id, item_id)
+        if item is None:
+            raise Http404
+        return item
+
+    # adding is not idempotent, retries with the same Idempotency-Key must not add again
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    def perform_destroy(self, instance):
+        self.cart_store.remove_item(self.cart_id, instance.id)
 
+    # many {product_id, quantity} lines in one request and one statement, all or nothing
+    @action(detail=False, methods=['POST'])
+    @idempotent
+    def batch(self, request, cart_pk=None):
+        serializer = AddCartItemSerializer(
+            data=request.data, many=True, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    # give the serializer the cart id from the url:
     def get_serializer_context(self):
-        return {'cart_id': self.kwargs['cart_pk']}
+        return {'cart_id': self.cart_id}
 
 
 class CustomerViewSet(ModelViewSet):
@@ -137,17 +396,58 @@ class CustomerViewSet(ModelViewSet):
             return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+def prefers_async(request):
+    # RFC 7240 preferences, e.g. `Prefer: respond-async, wait=10`
+    preferences = request.headers.get('Prefer', '').split(',')
+    return 'respond-async' in (preference.split(';')[0].strip().lower() for preference in preferences)
+
+
+class CheckoutViewSet(RetrieveModelMixin, GenericViewSet):
+    serializer_class = CheckoutSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return Checkout.objects.filter(user_id=self.request.user.id).select_related(
+            'order').prefetch_related('order__orderitems__product')
+
+
 class OrderViewSet(ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options']
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = OrderFilter
+    pagination_class = OrderCursorPagination
+    export_chunk_size = 2000
 
     def get_permissions(self):
         # only admins should be able to update or delete order
-        if self.request.method in ['PATCH', 'DELETE']:
+        if self.request.method in ['PATCH', 'DELETE'] or self.action == 'export':
             return [IsAdminUser()]
         return [IsAuthenticated()]
 
+    # staff see every order, so their list is keyset paginated; a customer's own
+    # order list stays a plain list
+    def paginate_queryset(self, queryset):
+        if not self.request.user.is_staff:
+            return None
+        return super().paginate_queryset(queryset)
+
+    # back-office export of the filtered orders as NDJSON, streamed in chunks
+    # (one query for the orders and one for their items per chunk)
+    @action(detail=False, methods=['GET'])
+    def export(self, request):
+        orders = self.filter_queryset(self.get_queryset()).order_by('placed_at', 'id')
+        response = StreamingHttpResponse(
+            export_ndjson(SerializerRows(OrderSerializer), orders, self.export_chunk_size),
+            content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="orders.ndjson"'
+        return response
+
     # override to return saved order instead of cartId
+    # retries with the same Idempotency-Key get the first response (store/idempotency.py)
+    @idempotent
     def create(self, request, *args, **kwargs):
+        if prefers_async(request):
+            return self.create_async(request)
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         order = serializer.save()
@@ -155,6 +455,17 @@ class OrderViewSet(ModelViewSet):
         serializer = OrderSerializer(order)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+    # with `Prefer: respond-async` the checkout is queued for a worker (store.tasks)
+    # and answered with 202 and the checkout to poll until it has the order
+    def create_async(self, request):
+        serializer = AddCheckoutSerializer(
+            data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        checkout = serializer.save()
+        location = reverse('checkouts-detail', args=[checkout.id], request=request)
+        return Response(CheckoutSerializer(checkout).data, status=status.HTTP_202_ACCEPTED,
+                        headers={'Location': location, 'Preference-Applied': 'respond-async'})
+
     def get_serializer_class(self):
         if self.request.method == 'POST':
             return AddOrderSerializer
@@ -167,11 +478,14 @@ class OrderViewSet(ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
+        # items with only the product columns SimpleProductSerializer shows
+        items = OrderItem.objects.select_related('product').only(
+            'id', 'order_id', 'product_id', 'quantity', 'unit_price',
+            'product__id', 'product__title', 'product__unit_price')
+        orders = Order.objects.prefetch_related(Prefetch('orderitems', queryset=items))
         if user.is_staff:
-            return Order.objects.prefetch_related('orderitems__product').all()
-        (customer_id, created) = Customer.objects.only(
-            'id').get(user_id=user.id)
-        return Order.objects.filter(customer_id=customer_id).prefetch_related('orderitems__product')
+            return orders
+        return orders.filter(customer__user_id=user.id)
 
 
 # CRUD GENERIC VIEWS
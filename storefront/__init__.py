@@ -1,3 +1,4 @@
-# from .celery import app
+# load the celery app with django so shared_task binds to it
+from .celery import app as celery_app
 
-# __all__ = ("celery",)
+__all__ = ("celery_app",)
@@ -222,7 +222,11 @@ CELERY_BEAT_SCHEDULE = {
         "task": "playground.tasks.send_feedback_email_task",
         "schedule": 5,
         "args": ['celerybeat@celery.org', 'Scheduled every 5 seconds with celery beat']
-    }
+    },
+    "delete_idle_carts_task": {
+        "task": "store.tasks.delete_idle_carts_task",
+        "schedule": 60 * 60,
+    },
 }
 
 # redis for caching config:
@@ -236,6 +240,25 @@ CACHES = {
         }
     }
 }
+# catalog responses are invalidated by version bumps (store/caching.py),
+# the timeout only bounds how long unused entries occupy memory
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
+# where carts live until checkout: 'store.carts.DatabaseCartStore' (Cart/CartItem
+# tables) or 'store.carts.CacheCartStore' (one entry per cart in the default cache)
+CART_STORE = 'store.carts.DatabaseCartStore'
+# carts are deleted this many seconds after they were last changed; the hourly cleanup deletes at most
+# CART_CLEANUP_MAX_BATCHES batches of CART_CLEANUP_BATCH_SIZE carts per run
+CART_IDLE_TIMEOUT = 60 * 60 * 24 * 7
+CART_CLEANUP_BATCH_SIZE = 1000
+CART_CLEANUP_MAX_BATCHES = 100
+
+# successful responses to requests with an Idempotency-Key header are replayed
+# to retries for this many seconds (store/idempotency.py); a duplicate waits up
+# to IDEMPOTENCY_LOCK_WAIT seconds for the original before getting a 409
+IDEMPOTENCY_KEY_TIMEOUT = 60 * 60 * 24
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+IDEMPOTENCY_LOCK_WAIT = 10
 
 LOGGING = {
     'version': 1,